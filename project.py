@@ -3,19 +3,195 @@
 author: Aglaia Kakoulidou
 """
 
-import pandas as pd
+from __future__ import annotations
+
+import numpy as np
 import json
-import networkx as nx
-import matplotlib.pyplot as plt
 import os
-
-
+import hashlib
+import heapq
+import tempfile
+import time
+import tracemalloc
+import glob
+import shutil
+import argparse
+import array
+import gzip
+import itertools
+import functools
+import multiprocessing
+from collections import Counter
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from http import HTTPStatus
+from typing import Iterable, Iterator, NamedTuple
+
+try:
+    import resource
+except ImportError:
+    # not available on windows, the profile then leaves out the peak RSS
+    resource = None
+
+
+class Profile:
+
+    """ Record of the stages of the assembly pipeline that ran inside a
+    profile() block. Every stage is a dict with its name, its depth (the
+    number of stages it ran inside), its wall time, the peak memory
+    allocated above its start as traced by tracemalloc (when memory is
+    True), the peak RSS of the process so far and its item counts """
+
+    def __init__(self, memory: bool = True):
+        self.memory = memory
+        self.stages = []
+        self._open = []
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict]:
+        """ Function that records one stage, the caller adds its item
+        counts to the dict that is yielded """
+
+        record = {"stage": name, "depth": len(self._open)}
+        self.stages.append(record)
+        if self.memory:
+            # fold the peak so far into the stages that are open, so that
+            # the peak can be reset for this one
+            current, peak = tracemalloc.get_traced_memory()
+            for outer in self._open:
+                outer["_peak"] = max(outer["_peak"], peak)
+            tracemalloc.reset_peak()
+            record["_start"] = record["_peak"] = current
+        self._open.append(record)
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self._open.pop()
+            if self.memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(record.pop("_peak"), peak)
+                record["peak_memory"] = peak - record.pop("_start")
+                if self._open:
+                    self._open[-1]["_peak"] = max(self._open[-1]["_peak"], peak)
+            if resource is not None:
+                # kilobytes on linux
+                record["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def to_json(self) -> str:
+        """ Function that returns the stages as a JSON document"""
+        return json.dumps({"stages": self.stages}, indent=2)
+
+
+# profile of the running profile() block, None when nothing is profiled so
+# that the stages cost a single check
+_PROFILE = None
+
+
+@contextmanager
+def profile(memory: bool = True) -> Iterator[Profile]:
+
+    """ Function that records the wall time, memory and item counts of every
+    stage of the pipeline that runs inside the with block, in the Profile
+    that it yields. Tracing the memory slows the stages down, memory=False
+    only records the times and counts """
+
+    global _PROFILE
+    previous = _PROFILE
+    _PROFILE = Profile(memory)
+    tracing = memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        yield _PROFILE
+    finally:
+        if tracing:
+            tracemalloc.stop()
+        _PROFILE = previous
+
+
+def _profiled(name: str, counts=None):
+
+    """ Helper function that makes a function a stage of the pipeline for
+    profile(). counts maps the result and the arguments of a call to the
+    item counts of the stage """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILE is None:
+                return func(*args, **kwargs)
+            with _PROFILE.stage(name) as record:
+                result = func(*args, **kwargs)
+                if counts is not None:
+                    record.update(counts(result, *args, **kwargs))
+            return result
+        return wrapper
+    return decorator
+
+
+def _graph_counts(graph, *args, **kwargs) -> dict:
+    """ Helper function that returns the item counts of a graph, one kmer
+    per edge"""
+    edges = graph.number_of_edges()
+    return {"kmers": edges, "nodes": graph.number_of_nodes(), "edges": edges}
+
+
+class _LazyModule:
+
+    """ Stand-in for a module that is slow to import. The module is imported
+    the first time one of its attributes is used, and then replaces the
+    stand-in in the globals of this module, so that the assembly of packed
+    graphs never imports pandas or networkx """
+
+    def __init__(self, name: str, alias: str):
+        self._name = name
+        self._alias = alias
+
+    def __getattr__(self, attribute: str):
+        # the built-in import, unlike importlib.import_module, is reported
+        # by python -X importtime
+        module = __import__(self._name)
+        globals()[self._alias] = module
+        return getattr(module, attribute)
+
+
+pd = _LazyModule("pandas", "pd")
+nx = _LazyModule("networkx", "nx")
+# only the job service uses asyncio
+asyncio = _LazyModule("asyncio", "asyncio")
+
+
+# columns of the DNA_[x]_[k].csv files
+COLUMNS = ["SegmentNr", "Position", "A", "C", "G", "T"]
+
+
+@_profiled("read_csv", lambda df, *args, **kwargs: {"rows": len(df)})
 def read_csv(name: str) -> pd.DataFrame:
     """ Function that reads a file with a given name"""
-    df = pd.read_csv(name, names=["SegmentNr", "Position", "A", "C", "G", "T"], header=None)
+    df = pd.read_csv(name, names=COLUMNS, header=None)
     return df
 
 
+@_profiled("read_rows", lambda rows, *args: {"rows": len(rows)})
+def read_rows(name: str) -> np.ndarray:
+    """ Function that reads a DNA_[x]_[k].csv file into an array with one
+    row per line and the columns of COLUMNS, with NumPy only"""
+
+    if os.path.getsize(name) == 0:
+        return np.empty((0, len(COLUMNS)), dtype=np.int64)
+    return np.loadtxt(name, delimiter=",", dtype=np.int64, ndmin=2)
+
+
+# lookup table that maps the column index of a one-hot row to its nucleotide
+_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)
+
+
+@_profiled("sequencer", lambda sequences, df: {"rows": len(df), "segments": len(sequences)})
 def _sequencer(df: pd.DataFrame) -> dict:
 
     """ Helper function that reads a pandas dataframe with format
@@ -24,31 +200,80 @@ def _sequencer(df: pd.DataFrame) -> dict:
 
     sequences = {}
 
-    for seg in df["SegmentNr"].unique():
-        seg_df = df.loc[df["SegmentNr"] == seg]
+    if len(df) == 0:
+        return sequences
+
+    # number the segments in order of appearance and gather the rows of
+    # each segment together (a no-op for frames sorted by segment)
+    codes, segments = pd.factorize(df["SegmentNr"])
+    onehot = df[["A", "C", "G", "T"]].to_numpy()
+    if (np.diff(codes) < 0).any():
+        order = np.argsort(codes, kind="stable")
+        codes = codes[order]
+        onehot = onehot[order]
 
-        # temporary list that stores the sequences of each segment
-        seq_temp = []
+    present, columns = _decode_onehot(onehot)
+    seq_bytes = _BASES[columns]
 
-        for A, C, G, T in zip(seg_df["A"], seg_df["C"], seg_df["G"], seg_df["T"]):
-            if A == 1:
-                seq_temp.append("A")
-            elif C == 1:
-                seq_temp.append("C")
-            elif G == 1:
-                seq_temp.append("G")
-            elif T == 1:
-                seq_temp.append("T")            
+    # split the decoded block at the segment boundaries
+    lengths = np.bincount(codes[present], minlength=len(segments))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    text = seq_bytes.tobytes().decode("ascii")
 
-        sequences[int(seg)] = "".join(seq_temp)
+    for i, seg in enumerate(segments):
+        sequences[int(seg)] = text[offsets[i]:offsets[i + 1]]
     return sequences
 
 
-def clean_data(df: pd.DataFrame) -> pd.DataFrame:
-    """ Function that cleans the data of a given dataframe """
+def _decode_onehot(onehot: np.ndarray) -> tuple:
+
+    """ Helper function that decodes every row of an A/C/G/T block at once:
+    the first column that equals 1 is the nucleotide and rows without any
+    hit are skipped. Returns the mask of decoded rows and their column
+    indices (A=0, C=1, G=2, T=3) """
+
+    hits = onehot == 1
+    present = hits.any(axis=1)
+    return present, hits.argmax(axis=1)[present].astype(np.uint8)
+
+
+def _segment_bounds(segments: np.ndarray) -> np.ndarray:
+
+    """ Helper function that reads a sorted array of segment numbers and
+    returns the offsets where each segment starts, followed by the total
+    number of rows """
+
+    if len(segments) == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    starts = np.flatnonzero(segments[1:] != segments[:-1]) + 1
+    return np.concatenate(([0], starts, [len(segments)]))
+
 
-    clean_df = df.copy()
-    bad_idx = []    
+@_profiled("clean_data", lambda result, df, return_sequences=False: {
+    "rows_in": len(df),
+    "segments_kept": (result[0] if return_sequences else result)["SegmentNr"].nunique()})
+def clean_data(df: pd.DataFrame, return_sequences: bool = False) -> pd.DataFrame:
+    """ Function that cleans the data of a given dataframe. With
+    return_sequences=True it also returns the {SegmentNr: sequence} dict
+    of the cleaned segments, which it decodes anyway """
+
+    clean_df = _drop_bad_segments(df)
+
+    # remove the clean_df segments with the same sequence as an earlier one
+    clean_df, sequences = _deduplicate(clean_df)
+    clean_df = clean_df.sort_values(["SegmentNr", "Position"])
+
+    if return_sequences:
+        return clean_df, sequences
+    return clean_df
+
+
+def _drop_bad_segments(df: pd.DataFrame) -> pd.DataFrame:
+
+    """ Helper function that runs the checks of clean_data on every segment
+    of a frame and returns the rows of the segments that pass them, sorted
+    by segment and position """
 
     # remove duplicates where position and nucleotides are the same
     clean_df = df.drop_duplicates(subset=["SegmentNr", "Position", "A", "C", "G", "T"], keep="first")
@@ -57,115 +282,851 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
     clean_df = (clean_df.sort_values(["SegmentNr", "Position"])
                 .reset_index(drop=True))
 
-    for seg in clean_df["SegmentNr"].unique():
-        seg_df = clean_df.loc[clean_df["SegmentNr"] == seg]     
+    if len(clean_df) > 0:
+        bad_rows = _bad_segment_rows(clean_df["SegmentNr"].to_numpy(), clean_df["Position"].to_numpy(),
+                                     clean_df[["A", "C", "G", "T"]].to_numpy())
+        clean_df = clean_df.loc[~bad_rows]
 
-        m = seg_df["Position"].max()  # calculate the value m
-        len_position = len(seg_df["Position"])  # calculate the length of each segment
+    return clean_df.reset_index(drop=True)
 
-        # dealing with missing positions in a segment
-        if len_position != m:
-            bad_idx.extend(seg_df.index.tolist())
-            continue
 
-        # check for position duplicates with different nucleotide entries
-        duplicates = seg_df.duplicated(subset=["Position"], keep=False)
-        if duplicates.any():
-            bad_idx.extend(seg_df.index.tolist())
-            continue
+def _bad_segment_rows(segments: np.ndarray, positions: np.ndarray, onehot: np.ndarray) -> np.ndarray:
 
-        # check for wrong position
-        # if the sum of the columns A, C, G, T > 1 it means that the segment will be ignored
-        if (seg_df[["A", "C", "G", "T"]].sum(axis=1) != 1).any():
-            bad_idx.extend(seg_df.index.tolist())  
-            continue
+    """ Helper function that runs the checks of clean_data on the columns of
+    rows sorted by segment and position, without exact duplicate rows, and
+    returns the mask of the rows of the segments that fail them """
 
-    clean_df = clean_df.drop(index=bad_idx).reset_index(drop=True)
+    # the rows are sorted, so every segment is a contiguous block of rows
+    # and all the checks can run for every segment at once
+    bounds = _segment_bounds(segments)
+    starts = bounds[:-1]
+    lengths = np.diff(bounds)
+
+    # dealing with missing positions in a segment
+    # (the length of the segment differs from the maximum position m)
+    m = np.fmax.reduceat(positions, starts)
+    bad_seg = m != lengths
+
+    # check for position duplicates with different nucleotide entries,
+    # which end up next to each other after sorting
+    duplicates = np.zeros(len(segments), dtype=bool)
+    duplicates[1:] = (segments[1:] == segments[:-1]) & (positions[1:] == positions[:-1])
+    bad_seg |= np.logical_or.reduceat(duplicates, starts)
+
+    # check for wrong position
+    # if the sum of the columns A, C, G, T != 1 the segment will be ignored
+    wrong = onehot.sum(axis=1) != 1
+    bad_seg |= np.logical_or.reduceat(wrong, starts)
+
+    # broadcast the verdict of each segment back to its rows
+    return np.repeat(bad_seg, lengths)
+
+
+def _deduplicate(clean_df: pd.DataFrame) -> tuple:
+
+    """ Helper function that removes from a frame sorted by segment the
+    segments whose sequence already occurs in an earlier segment. Every
+    segment is decoded and fingerprinted in one pass with a polynomial
+    hash of its nucleotide codes; only segments that share a fingerprint
+    and a length with an earlier one are compared character by character.
+    Returns the remaining frame and the {SegmentNr: sequence} dict of the
+    remaining segments """
+
+    if len(clean_df) == 0:
+        return clean_df, {}
+
+    keep, sequences = _unique_segments(clean_df["SegmentNr"].to_numpy(),
+                                       clean_df[["A", "C", "G", "T"]].to_numpy())
+    return clean_df.loc[keep].reset_index(drop=True), sequences
+
+
+def _unique_segments(segments: np.ndarray, onehot: np.ndarray) -> tuple:
+
+    """ Helper function that does the work of _deduplicate on the columns of
+    rows sorted by segment. Returns the mask of the rows to keep and the
+    {SegmentNr: sequence} dict of the kept segments """
+
+    bounds = _segment_bounds(segments)
+    present, columns = _decode_onehot(onehot)
+
+    # number of decoded nucleotides of every segment and their offsets in
+    # the decoded block
+    lengths = np.add.reduceat(present.astype(np.int64), bounds[:-1])
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    text = _BASES[columns].tobytes().decode("ascii")
+
+    # fingerprint: sum of (code + 1) * weight[position in segment] modulo 2**64
+    index = np.arange(len(columns)) - np.repeat(offsets[:-1], lengths)
+    weights = np.random.default_rng(0).integers(1, 2 ** 63, max(lengths.max(), 1), dtype=np.uint64)
+    terms = (columns.astype(np.uint64) + np.uint64(1)) * weights[index]
+    prefix = np.concatenate(([np.uint64(0)], np.cumsum(terms, dtype=np.uint64)))
+    fingerprints = prefix[offsets[1:]] - prefix[offsets[:-1]]
+
+    # mix the length into the fingerprint, equal sequences have equal keys
+    keys = fingerprints ^ (lengths.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15))
+    _, first, group = np.unique(keys, return_index=True, return_inverse=True)
+
+    keep = np.zeros(len(lengths), dtype=bool)
+    keep[first] = True
+
+    # verify the segments whose key was already seen, a different sequence
+    # means a fingerprint collision and the segment is kept
+    seen = {}
+    offsets = offsets.tolist()
+    for i, g in zip(np.flatnonzero(~keep).tolist(), group[~keep].tolist()):
+        if g not in seen:
+            j = first[g]
+            seen[g] = {text[offsets[j]:offsets[j + 1]]}
+        sequence = text[offsets[i]:offsets[i + 1]]
+        if sequence not in seen[g]:
+            seen[g].add(sequence)
+            keep[i] = True
+
+    sequences = {int(segments[bounds[i]]): text[offsets[i]:offsets[i + 1]]
+                 for i in np.flatnonzero(keep).tolist()}
+    return np.repeat(keep, np.diff(bounds)), sequences
+
+
+@_profiled("clean_rows", lambda sequences, rows: {"rows_in": len(rows), "segments_kept": len(sequences)})
+def clean_rows(rows: np.ndarray) -> dict:
+    """ Function that cleans the rows returned by read_rows the way
+    clean_data cleans a dataframe, with NumPy only, and returns the
+    {SegmentNr: sequence} dict of the cleaned segments """
+
+    if len(rows) == 0:
+        return {}
+
+    # sort by segment and position, then remove the rows equal to the
+    # previous one (duplicates where position and nucleotides are the same)
+    rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+    repeated = np.zeros(len(rows), dtype=bool)
+    repeated[1:] = (rows[1:] == rows[:-1]).all(axis=1)
+    rows = rows[~repeated]
+
+    rows = rows[~_bad_segment_rows(rows[:, 0], rows[:, 1], rows[:, 2:])]
+    if len(rows) == 0:
+        return {}
+    _, sequences = _unique_segments(rows[:, 0], rows[:, 2:])
+    return sequences
 
-    seen = set()
 
-    # iterate over the keys and values of the sequences dict and
-    # remove the clean_df segments with the same sequences
+@_profiled("generate_sequences")
+def generate_sequences(df: pd.DataFrame, sequences: dict = None) -> json:
+    """ Function that generates all the sequences of a given dataframe
+    and converts them to JSON format, for export. construct_graph does not
+    need the JSON, it takes the sequences as they are. The sequences
+    returned by clean_data(df, return_sequences=True) can be passed to
+    skip decoding the dataframe again"""
+
+    if sequences is None:
+        sequences = _sequencer(df)
+    json_seq = json.dumps(sequences)
+    return json_seq
 
-    seen = set()
-    bad_seq = []
 
-    for key, value in _sequencer(clean_df).items():
-        if value in seen:
-            bad_seq.extend(
-                clean_df.loc[clean_df["SegmentNr"] == key].index.tolist()
-            )
-        else:
-            seen.add(value)
+def _iter_segment_blocks(rows: np.ndarray, window: int) -> Iterator[tuple]:
 
-    clean_df = clean_df.drop(index=bad_seq).reset_index(drop=True)
-    clean_df = clean_df.sort_values(["SegmentNr", "Position"])
+    """ Helper generator that reads an array of rows sorted by SegmentNr
+    (e.g. a memory-mapped run of an external sort) one window at a time
+    and yields a (SegmentNr, rows) pair per segment """
 
-    return clean_df
+    carry = rows[:0]
+    for start in range(0, len(rows), window):
+        block = np.concatenate((carry, rows[start:start + window]))
+        bounds = _segment_bounds(block[:, 0])
 
+        # the last segment of the window may continue in the next one
+        for i in range(len(bounds) - 2):
+            yield int(block[bounds[i], 0]), block[bounds[i]:bounds[i + 1]]
+        carry = block[bounds[-2]:]
 
-def generate_sequences(df: pd.DataFrame) -> json:
-    """ Function that generates all the sequences of a given dataframe
-    and converts them to JSON format"""
+    if len(carry) > 0:
+        yield int(carry[0, 0]), carry
 
-    json_seq = json.dumps(_sequencer(df))
-    return json_seq
+
+def _external_sort(chunks: Iterator[pd.DataFrame], directory: str, chunksize: int) -> Iterator[pd.DataFrame]:
+
+    """ Helper generator that sorts a csv that does not fit in memory by
+    SegmentNr. Every chunk is sorted and spilled to a .npy run in the given
+    directory, then the runs are merged segment by segment and regrouped
+    into chunks of about chunksize rows """
+
+    runs = []
+    for i, chunk in enumerate(chunks):
+        run = chunk.sort_values(["SegmentNr", "Position"]).to_numpy(dtype=np.int64)
+        path = os.path.join(directory, f"run_{i}.npy")
+        np.save(path, run)
+        runs.append(np.load(path, mmap_mode="r"))
+
+    # heapq.merge keeps the runs in input order for equal segment numbers
+    window = max(chunksize // max(len(runs), 1), 1)
+    merged = heapq.merge(*[_iter_segment_blocks(run, window) for run in runs],
+                         key=lambda item: item[0])
+
+    blocks = []
+    n_rows = 0
+    for _, block in merged:
+        blocks.append(block)
+        n_rows += len(block)
+        if n_rows >= chunksize:
+            yield pd.DataFrame(np.concatenate(blocks), columns=COLUMNS)
+            blocks = []
+            n_rows = 0
+    if blocks:
+        yield pd.DataFrame(np.concatenate(blocks), columns=COLUMNS)
+
+
+def iter_sequences(name: str, chunksize: int = 1_000_000, presorted: bool = True) -> Iterator[tuple]:
+
+    """ Function that reads a csv file in chunks of chunksize rows and
+    yields a (SegmentNr, sequence) pair for every segment that survives
+    clean_data, as soon as all the rows of the segment have been read.
+
+    With presorted=True the rows of the file must be grouped by ascending
+    SegmentNr, which is checked while reading. Otherwise the file is first
+    sorted externally through temporary files. In both cases only a chunk
+    and a 16-byte fingerprint per distinct sequence are kept in memory, and
+    the sequences are the same as _sequencer(clean_data(read_csv(name))) """
+
+    with tempfile.TemporaryDirectory() as directory:
+        chunks = pd.read_csv(name, names=COLUMNS, header=None, chunksize=chunksize)
+        if not presorted:
+            chunks = _external_sort(chunks, directory, chunksize)
+
+        seen = set()
+        carry = None
+        for chunk in chunks:
+            if carry is not None:
+                chunk = pd.concat([carry, chunk], ignore_index=True)
+
+            segments = chunk["SegmentNr"].to_numpy()
+            if (np.diff(segments) < 0).any():
+                raise ValueError(f"{name} is not sorted by SegmentNr, use presorted=False")
+
+            # the last segment of the chunk may continue in the next one
+            complete = segments != segments[-1]
+            carry = chunk.loc[~complete]
+            yield from _clean_sequences(chunk.loc[complete], seen)
+
+        if carry is not None:
+            yield from _clean_sequences(carry, seen)
+
+
+def _clean_sequences(chunk: pd.DataFrame, seen: set) -> Iterator[tuple]:
+
+    """ Helper generator that cleans a chunk of complete segments and
+    yields the ones whose sequence has not been seen in earlier chunks """
+
+    for seg, sequence in clean_data(chunk, return_sequences=True)[1].items():
+        fingerprint = hashlib.blake2b(sequence.encode("ascii"), digest_size=16).digest()
+        if fingerprint not in seen:
+            seen.add(fingerprint)
+            yield seg, sequence
+
+
+class PackedSequences(Mapping):
+
+    """ Class that gives read-only {SegmentNr: sequence} access to a packed
+    sequence file written by save_sequences. The file holds three arrays
+    in .npy format one after the other: the segment numbers in ascending
+    order, the offsets of the segments and all the nucleotides as ASCII
+    bytes, one byte per nucleotide. The arrays are memory-mapped, so
+    loading the file does not read it and a sequence is only read from
+    disk when it is accessed """
+
+    def __init__(self, segments: np.ndarray, offsets: np.ndarray, bases: np.ndarray):
+        self.segments = segments
+        self.offsets = offsets
+        self.bases = bases
+
+    def __getitem__(self, seg: int) -> str:
+        i = np.searchsorted(self.segments, seg)
+        if i == len(self.segments) or self.segments[i] != seg:
+            raise KeyError(seg)
+        return self._sequence(i)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.segments.tolist())
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def _sequence(self, i: int) -> str:
+        return self.bases[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("ascii")
+
+    def values(self) -> Iterator[str]:
+        """ Generator that yields the sequences in order of segment number,
+        without looking up each segment"""
+        for i in range(len(self.segments)):
+            yield self._sequence(i)
+
+
+def save_sequences(sequences: dict, name: str):
+
+    """ Function that saves a {SegmentNr: sequence} dict, as returned by
+    clean_data(df, return_sequences=True), to a packed sequence file
+    (see PackedSequences) """
+
+    items = sorted(sequences.items())
+    segments = np.array([seg for seg, _ in items], dtype=np.int64)
+    lengths = np.array([len(seq) for _, seq in items], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+    bases = np.frombuffer("".join(seq for _, seq in items).encode("ascii"), dtype=np.uint8)
+
+    with open(name, "wb") as f:
+        for part in (segments, offsets, bases):
+            np.save(f, part)
+
+
+def load_sequences(name: str) -> PackedSequences:
+    """ Function that memory-maps a packed sequence file written by
+    save_sequences"""
+
+    arrays = []
+    with open(name, "rb") as f:
+        for _ in range(3):
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+
+            offset = f.tell()
+            size = int(np.prod(shape)) * dtype.itemsize
+            if size > 0:
+                arrays.append(np.memmap(name, dtype=dtype, mode="r", offset=offset, shape=shape))
+            else:
+                arrays.append(np.empty(shape, dtype=dtype))
+            f.seek(offset + size)
+
+    return PackedSequences(*arrays)
+
+
+def convert_csv(name: str, output: str = None) -> str:
+
+    """ Function that reads and cleans a DNA_[x]_[k].csv file once and saves
+    its sequences to a packed sequence file, DNA_[x]_[k].npseq by default.
+    Returns the name of the new file """
+
+    if output is None:
+        output = os.path.splitext(name)[0] + ".npseq"
+
+    _, sequences = clean_data(read_csv(name), return_sequences=True)
+    save_sequences(sequences, output)
+    return output
+
+
+# lookup table that maps the ASCII code of a nucleotide to its 2-bit code,
+# any other character is mapped to 255
+_CODES = np.full(256, 255, dtype=np.uint8)
+_CODES[_BASES] = np.arange(4, dtype=np.uint8)
 
 
 def _find_kmers(sequence: str, k: int) -> list:
     """ Helper function that finds all the kmers of a given sequence"""
-    result = []
-    # base case
-    if len(sequence) < k:
-        return result
+    return list(_iter_kmers(sequence, k))
 
-    # find the kmer of each given sequence
-    kmer1 = sequence[0:k]
-    result.append(kmer1)
-    result.extend(_find_kmers(sequence[1:], k))
 
-    return result
+def _iter_kmers(sequence: str, k: int) -> Iterator[str]:
+
+    """ Helper generator that yields the kmers of a given sequence one by
+    one. Sequences given as bytes are wrapped in a memoryview, so their
+    kmers are views on the original buffer instead of copies """
+
+    if isinstance(sequence, (bytes, bytearray)):
+        sequence = memoryview(sequence)
+
+    for i in range(len(sequence) - k + 1):
+        yield sequence[i:i + k]
+
+
+def _encode(sequence: str) -> np.ndarray:
+    """ Helper function that converts a sequence to an array of 2-bit codes
+    (A=0, C=1, G=2, T=3)"""
+
+    if isinstance(sequence, str):
+        sequence = sequence.encode("ascii")
+    codes = _CODES[np.frombuffer(sequence, dtype=np.uint8)]
+
+    if (codes > 3).any():
+        raise ValueError("The sequence can only contain the nucleotides A, C, G and T")
+    return codes
+
+
+def _pack_kmers(sequence: str, k: int) -> np.ndarray:
+
+    """ Helper function that finds all the kmers of a given sequence and
+    packs each of them into an unsigned 64-bit integer, 2 bits per
+    nucleotide with the first nucleotide in the highest bits """
+
+    return _pack_codes(_encode(sequence), k)
+
+
+def _pack_codes(codes: np.ndarray, k: int) -> np.ndarray:
+    """ Helper function that packs every window of k consecutive 2-bit
+    codes into an unsigned 64-bit integer"""
+
+    if not 1 <= k <= 32:
+        raise ValueError("Packed kmers need a k between 1 and 32")
+
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint64)
+
+    # shift in one nucleotide column per step, k vectorized passes in total
+    packed = np.zeros(n, dtype=np.uint64)
+    for i in range(k):
+        packed <<= np.uint64(2)
+        packed |= codes[i:i + n].astype(np.uint64)
+    return packed
+
+
+def _unpack_kmer(value: int, k: int) -> str:
+    """ Helper function that converts a packed kmer back to its sequence"""
+
+    shifts = np.arange(2 * (k - 1), -1, -2, dtype=np.uint64)
+    codes = (np.uint64(value) >> shifts) & np.uint64(3)
+    return _BASES[codes].tobytes().decode("ascii")
+
+
+# translation table that complements every nucleotide of a sequence
+_COMPLEMENT = str.maketrans("ACGT", "TGCA")
 
 
-def construct_graph(json_data: json, k: int) -> nx.MultiGraph:
+def _reverse_complement(sequence: str) -> str:
+    """ Helper function that returns the sequence of the opposite strand"""
+    return sequence.translate(_COMPLEMENT)[::-1]
+
+
+def _canonical_codes(codes: np.ndarray, k: int) -> tuple:
+
+    """ Helper function that packs every window of k codes and the reverse
+    complement of the window, and returns the smaller of the two (the
+    canonical kmer, the same on both strands) with the strand of each
+    window: 1 if the canonical kmer is the window as read, -1 if it is the
+    reverse complement and 0 for palindromes, which read the same on both
+    strands. The reverse complements are the windows of the complemented
+    codes read backwards, so both strands take the same k shift passes """
+
+    forward = _pack_codes(codes, k)
+    reverse = _pack_codes(3 - codes[::-1], k)[::-1]
+    strand = (forward < reverse).astype(np.int8) - (forward > reverse)
+    return np.minimum(forward, reverse), strand
+
+
+def orient_sequences(sequences: Iterable[str], k: int) -> list:
+
+    """ Function that puts segments read from either strand on the same
+    strand, so that their kmers join into one graph. Segments that share
+    a canonical (k-1)-mer, a node of the graph, overlap: on the same
+    strand if it is read the same way in both and on opposite strands
+    otherwise. The overlaps join the segments into groups, and every
+    segment is reverse complemented if it is on the other strand than the
+    first segment of its group. The overlaps with the most shared nodes
+    are applied first and an overlap that contradicts the earlier ones,
+    such as one across an inverted repeat, is ignored, so k must be large
+    enough for most nodes to occur once in the genome. Nodes longer than
+    32 nucleotides are compared on windows of 32 """
+
+    return _orient_sequences(list(sequences), k)
+
+
+@_profiled("orient_sequences", lambda oriented, sequences, k: {
+    "segments": len(oriented), "reversed": sum(1 for a, b in zip(sequences, oriented) if a is not b)})
+def _orient_sequences(sequences: list, k: int) -> list:
+    """ Helper function that does the work of orient_sequences on a list,
+    which the profile compares with the result to count the reversed
+    segments """
+
+    # the length of the nodes, which are compared on at most 32 nucleotides
+    node_k = min(k - 1, 32)
+    codes, offsets = _sequence_index(sequences)
+    if node_k < 1 or len(codes) < node_k:
+        return sequences
+
+    # canonical nodes of every segment, with the segment they belong to;
+    # palindromes read the same on both strands and are skipped
+    canonical, strand = _canonical_codes(codes, node_k)
+    owner = np.repeat(np.arange(len(sequences)), np.diff(offsets))[:len(canonical)]
+    inside = (np.arange(len(canonical)) + node_k <= offsets[1:][owner]) & (strand != 0)
+    canonical, forward, owner = canonical[inside], strand[inside] > 0, owner[inside]
+
+    # link every occurrence of a node to its first occurrence, with 1 if the
+    # two are on opposite strands
+    order = np.argsort(canonical, kind="stable")
+    canonical, forward, owner = canonical[order], forward[order], owner[order]
+    starts = np.concatenate(([True], canonical[1:] != canonical[:-1]))
+    first = np.flatnonzero(starts)[np.cumsum(starts) - 1]
+    linked = owner[first] != owner
+    if not linked.any():
+        return sequences
+
+    # one integer per link, so that the links are counted with a flat sort
+    n = len(sequences)
+    links = (owner[first][linked] * n + owner[linked]) * 2 + (forward[first] != forward)[linked]
+    links, support = np.unique(links, return_counts=True)
+    links = links[np.argsort(-support, kind="stable")]
+    pairs = np.column_stack((links // 2 // n, links // 2 % n, links % 2))
+
+    # union-find that keeps the strand of every segment relative to its parent
+    parent = list(range(len(sequences)))
+    flip = [0] * len(sequences)
+
+    def find(i: int) -> tuple:
+        path = []
+        while parent[i] != i:
+            path.append(i)
+            i = parent[i]
+        # compress the path, from the root down
+        strand = 0
+        for j in reversed(path):
+            strand ^= flip[j]
+            flip[j] = strand
+            parent[j] = i
+        return i, flip[path[0]] if path else 0
+
+    for a, b, opposite in pairs.tolist():
+        (root_a, strand_a), (root_b, strand_b) = find(a), find(b)
+        if root_a == root_b:
+            continue
+        # the group is named after its first segment, which keeps its strand
+        if root_b < root_a:
+            root_a, root_b = root_b, root_a
+        parent[root_b] = root_a
+        flip[root_b] = strand_a ^ strand_b ^ opposite
+
+    return [_reverse_complement(seq) if find(i)[1] else seq for i, seq in enumerate(sequences)]
+
+
+class PackedGraph:
+
+    """ Class that stores a de Bruijn graph with integer-encoded nodes, as a
+    compact alternative to nx.MultiDiGraph for large inputs.
+
+    Every (k-1)mer is packed into a 64-bit integer (2 bits per nucleotide)
+    and the nodes are numbered by their position in the sorted array
+    `kmers`. The edges are stored in CSR form: the successors of node v
+    are `indices[indptr[v]:indptr[v + 1]]` and `counts` holds the
+    multiplicity of each of them, so a repeated kmer costs nothing extra.
+    Together with the in and out degree of every node this comes to 8
+    bytes per distinct edge plus 32 bytes per node, about 40 bytes per
+    edge for a de Bruijn graph of a genome (see `python project_bench.py
+    graph_memory`), against roughly 950 bytes per edge for nx.MultiDiGraph.
+
+    The class also provides the basic part of the networkx interface
+    (nodes, edges, degrees and successors), with nodes numbered 0..V-1;
+    label(v) gives back the (k-1)mer of a node.
+
+    The successors of every node are kept in the order in which their
+    edges first occur in the input, and first_node is the node of the
+    first kmer, the start of the euler path of a balanced graph. The
+    traversal then takes the same turns as on the nx.MultiDiGraph of the
+    same input, and both backends assemble the same sequence """
+
+    def __init__(self, kmers: np.ndarray, indptr: np.ndarray, indices: np.ndarray,
+                 counts: np.ndarray, k: int, first_node: int = 0):
+        self.kmers = kmers
+        self.indptr = indptr
+        self.indices = indices
+        self.counts = counts
+        self.k = k
+        self.first_node = first_node
+        self.graph = {}
+
+        sources = np.repeat(np.arange(len(kmers)), np.diff(indptr))
+        self._out_degree = np.bincount(sources, weights=counts, minlength=len(kmers)).astype(np.int64)
+        self._in_degree = np.bincount(indices, weights=counts, minlength=len(kmers)).astype(np.int64)
+
+    @classmethod
+    def from_kmers(cls, kmers: np.ndarray, k: int, counts: np.ndarray = None,
+                   first: np.ndarray = None) -> "PackedGraph":
+        """ Function that creates the graph from an array of packed kmers,
+        where counts optionally holds the number of copies of each kmer and
+        first the position in the input of its first occurrence (by
+        default, the order of kmers)"""
+
+        if not 2 <= k <= 32:
+            raise ValueError("A packed graph needs a k between 2 and 32")
+
+        # the left (k-1)mer drops the last nucleotide and the right one the first
+        kmers = np.asarray(kmers, dtype=np.uint64)
+        left = kmers >> np.uint64(2)
+        right = kmers & np.uint64((1 << 2 * (k - 1)) - 1)
+
+        nodes, ids = np.unique(np.concatenate((left, right)), return_inverse=True)
+        n_nodes = len(nodes)
+        if first is None:
+            first = np.arange(len(kmers))
+        first_node = int(ids[np.argmin(first)]) if len(kmers) else 0
+
+        # merge parallel edges into one entry with a multiplicity, sorted by
+        # source so that they can be sliced per node, and then by their
+        # first occurrence
+        pairs = ids[:len(kmers)].astype(np.int64) * n_nodes + ids[len(kmers):]
+        pairs, ids = np.unique(pairs, return_inverse=True)
+        counts = np.bincount(ids, weights=counts, minlength=len(pairs))
+        pair_first = np.full(len(pairs), np.iinfo(np.int64).max)
+        np.minimum.at(pair_first, ids, np.asarray(first, dtype=np.int64))
+        sources = pairs // n_nodes if n_nodes else pairs
+        order = np.lexsort((pair_first, sources))
+        pairs, counts, sources = pairs[order], counts[order], sources[order]
+
+        indptr = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=n_nodes), out=indptr[1:])
+        index_type = np.int32 if n_nodes < 2 ** 31 else np.int64
+        indices = (pairs % n_nodes if n_nodes else pairs).astype(index_type)
+
+        return cls(nodes, indptr, indices, counts.astype(np.uint32), k, first_node)
+
+    def __len__(self) -> int:
+        return len(self.kmers)
+
+    def __getitem__(self, v: int) -> list:
+        """ Function that returns the distinct successors of a node"""
+        return self.indices[self.indptr[v]:self.indptr[v + 1]].tolist()
+
+    @property
+    def nbytes(self) -> int:
+        """ Number of bytes used by the arrays of the graph"""
+        return (self.kmers.nbytes + self.indptr.nbytes + self.indices.nbytes + self.counts.nbytes
+                + self._out_degree.nbytes + self._in_degree.nbytes)
+
+    def nodes(self) -> range:
+        return range(len(self.kmers))
+
+    def edges(self) -> Iterator[tuple]:
+        """ Generator that yields every edge as a pair of (k-1)mers, once per
+        multiplicity like nx.MultiDiGraph.edges() """
+        for v in self.nodes():
+            for i in range(self.indptr[v], self.indptr[v + 1]):
+                for _ in range(self.counts[i]):
+                    yield self.label(v), self.label(self.indices[i])
+
+    def number_of_nodes(self) -> int:
+        return len(self.kmers)
+
+    def number_of_edges(self) -> int:
+        return int(self.counts.sum())
+
+    def out_degree(self, v: int) -> int:
+        return int(self._out_degree[v])
+
+    def in_degree(self, v: int) -> int:
+        return int(self._in_degree[v])
+
+    def degree(self, v: int) -> int:
+        return int(self._out_degree[v] + self._in_degree[v])
+
+    def label(self, v: int) -> str:
+        """ Function that returns the (k-1)mer of a given node"""
+        return _unpack_kmer(self.kmers[v], self.k - 1)
+
+    def labels(self, vs: list) -> list:
+        """ Function that returns the (k-1)mers of a list of nodes, decoding
+        all of them at once"""
+
+        shifts = np.arange(2 * (self.k - 2), -1, -2, dtype=np.uint64)
+        codes = (self.kmers[np.asarray(vs, dtype=np.int64)][:, None] >> shifts) & np.uint64(3)
+        text = _BASES[codes].tobytes().decode("ascii")
+        return [text[i:i + self.k - 1] for i in range(0, len(text), self.k - 1)]
+
+
+@_profiled("construct_graph", _graph_counts)
+def construct_graph(json_data: json, k: int, packed: bool = False, workers: int = 1,
+                    min_count: int = 1, canonical: bool = False) -> nx.MultiGraph:
     """ Function that creates a Bruijn graph based a json file with 
-    sequences and a k integer"""
+    sequences and a k integer. Instead of the json text, json_data can be
+    the {SegmentNr: sequence} dict itself or any iterable of sequences,
+    which skips encoding and decoding every nucleotide as text. With
+    packed=True the graph is returned as a PackedGraph instead of a
+    networkx object, and with workers > 1 the kmers are counted by a pool
+    of that many processes. Kmers that occur fewer than min_count times,
+    such as the ones around a miscalled nucleotide, are dropped before
+    the graph is created, and the others become edges with their number
+    of occurrences as multiplicity. With canonical=True the segments are
+    first put on one strand with orient_sequences, for inputs that mix
+    segments read from both strands"""
+
+    # extract the sequences of the json_data and save them in raw_sequences
+    if isinstance(json_data, (str, bytes)):
+        raw_sequences = list(json.loads(json_data).values())
+    elif isinstance(json_data, Mapping):
+        raw_sequences = json_data.values()
+    else:
+        raw_sequences = json_data
+    if canonical:
+        raw_sequences = orient_sequences(raw_sequences, k)
+
+    if workers <= 1:
+        return _graph_from_sequences(raw_sequences, k, packed, min_count)
+
+    # small inputs are faster to process than to send to other processes
+    raw_sequences = list(raw_sequences)
+    if sum(len(seq) for seq in raw_sequences) >= _PARALLEL_MIN_BASES:
+        return _parallel_graph(raw_sequences, k, packed, workers, min_count)
+    return _graph_from_sequences(raw_sequences, k, packed, min_count)
+
 
-    # extract the sequences of the json_data file and save them in a list
-    # named raw_sequences
+# number of kmers that are collected before they are merged into the counts
+# of a packed graph under construction
+_KMER_BATCH = 1 << 23
 
-    seq_dict = json.loads(json_data)
-    raw_sequences = [sequence for sequence in seq_dict.values()]
+# total sequence length below which construct_graph ignores workers
+_PARALLEL_MIN_BASES = 1_000_000
 
-    # create a new list (of lists) that only has the kmers
-    kmers = []
-    for seq in raw_sequences:
-        kmers_seq = _find_kmers(seq, k)
-        kmers.append(kmers_seq)
 
-    # separate the contents of the kmers list into (k-1)mers and save them into 
-    # a dictionary with keys L and R
+@_profiled("graph_from_sequences", _graph_counts)
+def _graph_from_sequences(sequences: Iterable[str], k: int, packed: bool = False,
+                          min_count: int = 1) -> nx.MultiGraph:
 
-    edges = {"L": [], "R": []}
-    for temp_kmers in kmers:
-        for kmer in temp_kmers:
-            left = kmer[:-1]
-            right = kmer[1:]
-            edges["L"].append(left)
-            edges["R"].append(right)
+    """ Helper function that creates the de Bruijn graph of the kmers of the
+    given sequences that occur at least min_count times. The sequences
+    are consumed one at a time, so they can come from a generator such as
+    iter_sequences """
 
-    # initialize the graph object, iterate over the dictionary
-    # and iteratively add the edges
+    if packed:
+        kmers, counts, first = _count_packed_kmers(sequences, k)
+        keep = counts >= min_count
+        return PackedGraph.from_kmers(kmers[keep], k, counts[keep], first[keep])
+
+    # the kmers have to be counted before any of them becomes an edge
+    if min_count > 1:
+        return _graph_from_counts(_count_kmers(sequences, k, False), min_count)
+
+    # split every kmer into its left and right (k-1)mers and add them
+    # as an edge of the graph
 
     graph = nx.MultiDiGraph()
-    for L, R in zip(edges["L"], edges["R"]):
-        graph.add_edge(L, R)
+    for seq in sequences:
+        for kmer in _iter_kmers(seq, k):
+            graph.add_edge(kmer[:-1], kmer[1:])
     return graph
 
 
-def plot_graph(graph: nx.MultiDiGraph, filename: str):
-    """ Function that creates a file with the given graph object"""
+def _count_packed_kmers(sequences: Iterable[str], k: int) -> tuple:
+
+    """ Helper function that returns the distinct packed kmers of the given
+    sequences in a sorted array, together with the number of times each of
+    them occurs and the position of its first occurrence among all the
+    kmers of the sequences """
+
+    kmers = np.empty(0, dtype=np.uint64)
+    counts = np.empty(0, dtype=np.int64)
+    first = np.empty(0, dtype=np.int64)
+    pending = []
+    n_pending = 0
+    n_merged = 0
+    for seq in sequences:
+        pending.append(_pack_kmers(seq, k))
+        n_pending += len(pending[-1])
+
+        # keep one entry per distinct kmer instead of every occurrence
+        if n_pending >= _KMER_BATCH:
+            kmers, counts, first = _merge_kmer_counts(kmers, counts, first, pending, n_merged)
+            n_merged += n_pending
+            pending = []
+            n_pending = 0
+
+    return _merge_kmer_counts(kmers, counts, first, pending, n_merged)
+
+
+def _count_kmers(sequences: list, k: int, packed: bool):
+
+    """ Helper function that counts the kmers of a shard of sequences in a
+    worker process, either packed into integers or in a Counter of strings
+    that keeps the order in which the kmers first occur """
+
+    if packed:
+        return _count_packed_kmers(sequences, k)
+
+    counts = Counter()
+    for seq in sequences:
+        counts.update(_iter_kmers(seq, k))
+    return counts
+
+
+def _shard(sequences: list, n_shards: int) -> list:
+    """ Helper function that splits a list of sequences into n_shards
+    consecutive shards with about the same number of nucleotides"""
+
+    bounds = np.cumsum([len(seq) for seq in sequences])
+    cuts = np.searchsorted(bounds, np.linspace(0, bounds[-1], n_shards + 1)[1:-1])
+    return [list(shard) for shard in np.split(np.array(sequences, dtype=object), cuts) if len(shard)]
+
+
+def _parallel_graph(sequences: list, k: int, packed: bool, workers: int, min_count: int = 1) -> nx.MultiGraph:
 
+    """ Helper function that counts the kmers of the sequences on a pool of
+    worker processes, merges the counts of the shards and creates the
+    graph of the kmers that occur at least min_count times, with the
+    merged counts as edge multiplicities """
+
+    shards = _shard(sequences, workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_count_kmers, shards, [k] * len(shards), [packed] * len(shards)))
+
+    if packed:
+        # the positions of a shard follow all the kmers of the shards before it
+        offsets = np.cumsum([0] + [counts.sum() for _, counts, _ in results])
+        kmers = np.concatenate([kmers for kmers, _, _ in results])
+        counts = np.concatenate([counts for _, counts, _ in results])
+        first = np.concatenate([first + offset for (_, _, first), offset in zip(results, offsets)])
+        kmers, counts, first = _merge_kmer_counts(kmers, counts, first, [], 0)
+        keep = counts >= min_count
+        return PackedGraph.from_kmers(kmers[keep], k, counts[keep], first[keep])
+
+    # the shards are merged in order, so every node and neighbour is added
+    # in the same order as by the serial construction
+    total = Counter()
+    for counts in results:
+        total.update(counts)
+    return _graph_from_counts(total, min_count)
+
+
+def _graph_from_counts(counts: Counter, min_count: int = 1) -> nx.MultiGraph:
+    """ Helper function that creates the graph of the counted kmers that
+    occur at least min_count times, adding them in the order of the
+    Counter with their counts as edge multiplicities"""
+
+    graph = nx.MultiDiGraph()
+    for kmer, count in counts.items():
+        if count >= min_count:
+            graph.add_edges_from([(kmer[:-1], kmer[1:])] * count)
+    return graph
+
+
+def _merge_kmer_counts(kmers: np.ndarray, counts: np.ndarray, first: np.ndarray,
+                       pending: list, offset: int) -> tuple:
+    """ Helper function that adds a list of packed kmer arrays, whose kmers
+    are numbered from offset on, to an array of distinct kmers with their
+    counts and first positions. The positions only grow along the merged
+    array, so the first occurrence of a kmer in it is its first one"""
+
+    new_kmers = np.concatenate([kmers] + pending)
+    new_counts = np.concatenate([counts] + [np.ones(len(p), dtype=np.int64) for p in pending])
+    new_first = np.concatenate([first, np.arange(offset, offset + len(new_kmers) - len(kmers))])
+
+    kmers, index, ids = np.unique(new_kmers, return_index=True, return_inverse=True)
+    counts = np.bincount(ids, weights=new_counts, minlength=len(kmers)).astype(np.int64)
+    return kmers, counts, new_first[index]
+
+
+# largest number of nodes that plot_graph draws, larger graphs are compacted
+# or cut down to the neighbourhood of the start of the euler path
+PLOT_MAX_NODES = 500
+
+
+def plot_graph(graph: nx.MultiDiGraph, filename: str, max_nodes: int = PLOT_MAX_NODES):
+
+    """ Function that creates a file with the given graph object. A graph with
+    more than max_nodes nodes is drawn at a lower level of detail: as its
+    compacted graph, or if that is still too large, as the max_nodes nodes
+    closest to the start of the euler path """
+
+    # matplotlib is slow to import and only needed here
+    import matplotlib.pyplot as plt
+
+    graph = _plot_view(graph, max_nodes)
     pos = nx.shell_layout(graph)
     plt.figure(figsize=(8, 6), constrained_layout=True)
 
@@ -177,10 +1138,11 @@ def plot_graph(graph: nx.MultiDiGraph, filename: str):
         linewidths=0.5,
     )
 
-    # adjusting the size of letters
+    # adjusting the size of letters, long unitigs are shortened
     nx.draw_networkx_labels(
         graph,
         pos,
+        labels={v: v if len(v) <= 12 else f"{v[:5]}..{v[-5:]}" for v in graph.nodes},
         font_size=4
     )
 
@@ -196,74 +1158,267 @@ def plot_graph(graph: nx.MultiDiGraph, filename: str):
     plt.close()
 
 
-def is_valid_graph(graph: nx.MultiDiGraph) -> bool:
-    """ Function that checks if a graph object is Eulerian"""
+def _plot_view(graph: nx.MultiDiGraph, max_nodes: int) -> nx.MultiDiGraph:
+    """ Helper function that returns the networkx graph that plot_graph draws
+    for a graph, with at most max_nodes nodes"""
+
+    if graph.number_of_nodes() > max_nodes:
+        graph = compact_graph(graph)
+    if graph.number_of_nodes() > max_nodes:
+        return _to_networkx(graph, _sample_nodes(graph, max_nodes))
+    return _to_networkx(graph) if isinstance(graph, PackedGraph) else graph
+
+
+def _sample_nodes(graph: nx.MultiDiGraph, max_nodes: int) -> list:
+
+    """ Helper function that returns the numbers of the max_nodes nodes
+    closest to the start of the euler path (or of the most unbalanced
+    vertex when there is none), found with a breadth-first
+    search that follows the edges in both directions """
+
+    nodes, indptr, indices, counts = _adjacency(graph)
+    if len(nodes) == 0:
+        return []
+    # the predecessors of every node in CSR form as well
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    out_degree = np.bincount(sources, weights=counts, minlength=len(nodes))
+    in_degree = np.bincount(indices, weights=counts, minlength=len(nodes))
+    order = np.argsort(indices, kind="stable")
+    reverse_indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=len(nodes)), out=reverse_indptr[1:])
+    predecessors = sources[order]
+
+    # the vertex with the most outgoing edges left over, as in _check_graph
+    start = int(np.argmax(out_degree - in_degree))
+    seen = {start}
+    queue = [start]
+    for v in queue:
+        neighbours = np.concatenate((indices[indptr[v]:indptr[v + 1]],
+                                     predecessors[reverse_indptr[v]:reverse_indptr[v + 1]]))
+        for w in neighbours.tolist():
+            if len(seen) == max_nodes:
+                return queue
+            if w not in seen:
+                seen.add(w)
+                queue.append(w)
+    return queue
+
+
+def _to_networkx(graph: nx.MultiDiGraph, vs: list = None) -> nx.MultiDiGraph:
+
+    """ Helper function that converts a graph, or the part of it between the
+    node numbers vs, to an nx.MultiDiGraph whose nodes are their labels """
+
+    nodes, indptr, indices, counts = _adjacency(graph)
+    vs = np.arange(len(nodes)) if vs is None else np.asarray(vs, dtype=np.int64)
+    labels = graph.labels(vs) if isinstance(graph, PackedGraph) else [nodes[v] for v in vs.tolist()]
+    names = dict(zip(vs.tolist(), labels))
+
+    result = nx.MultiDiGraph(overlap=_overlap(graph, nodes))
+    result.add_nodes_from(labels)
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    keep = np.zeros(len(nodes), dtype=bool)
+    keep[vs] = True
+    edges = keep[sources] & keep[indices]
+    for v, w, count in zip(sources[edges].tolist(), indices[edges].tolist(), counts[edges].tolist()):
+        result.add_edges_from([(names[v], names[w])] * count)
+    return result
 
-    # initialize a list that collects all the non compliant vertices
-    nc_vertices = {}
 
-    for v in graph.nodes():
-        degree_diff = graph.out_degree(v) - graph.in_degree(v)
+def export_graph(graph: nx.MultiDiGraph, filename: str):
 
-        # complying to the in_degree and out_degree rule
-        if degree_diff == 0:
-            continue
-        else:
-            nc_vertices[v] = degree_diff
+    """ Function that saves a graph for external viewers, as GraphML when
+    the filename ends with .graphml and as GFA 1.0 when it ends with .gfa.
+    In the GFA file every node is a segment numbered from 1 and every
+    distinct edge a link, with its multiplicity in the RC tag """
+
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == ".graphml":
+        nx.write_graphml(_to_networkx(graph), filename)
+    elif extension == ".gfa":
+        _write_gfa(graph, filename)
+    else:
+        raise ValueError("Graphs can be exported to .graphml or .gfa files")
 
-    # we check if the dictionary with the non-compliant vertices
-    # has a length of 0 or 2
-    length = len(nc_vertices)
 
-    if length != 0 and length != 2:
-        return False
+def _write_gfa(graph: nx.MultiDiGraph, filename: str, batch: int = 1 << 16):
+    """ Helper function that writes a graph to a GFA 1.0 file, decoding the
+    labels of a PackedGraph batch by batch"""
 
-    # if the length is 0 we start from any vertex
-    if length == 0:
-        for v in graph.nodes():
-            start_vertex = v
-            break
+    nodes, indptr, indices, counts = _adjacency(graph)
+    overlap = _overlap(graph, nodes)
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
 
-    # if the length is 2 we need to start from the one that has
-    # the outgoing edge
+    with open(filename, "w") as f:
+        f.write("H\tVN:Z:1.0\n")
+        for first in range(0, len(nodes), batch):
+            vs = range(first, min(first + batch, len(nodes)))
+            labels = graph.labels(vs) if isinstance(graph, PackedGraph) else nodes[first:first + batch]
+            f.writelines(f"S\t{v + 1}\t{label}\n" for v, label in zip(vs, labels))
+        for v, w, count in zip(sources.tolist(), indices.tolist(), counts.tolist()):
+            f.write(f"L\t{v + 1}\t+\t{w + 1}\t+\t{overlap}M\tRC:i:{count}\n")
 
-    elif length == 2:
-        if 1 not in nc_vertices.values() or -1 not in nc_vertices.values():
-            return False
-        else:
-            for n, d in nc_vertices.items():
-                # we ensure that the starting node is with the outgoing edge
-                if d == 1:
-                    start_vertex = n
-
-    # check for connectivity
-    c_nodes = []
-    for v in graph.nodes():
-        if graph.degree(v) > 0:
-            c_nodes.append(v)
-
-    # breadth first search algorithm to traverse all the edges
-    if len(c_nodes) != 0:
-        visited = []
-        queue = []
-        queue.append(start_vertex)
-        while len(queue) != 0:
-            v = queue.pop(0)
-            if v not in visited:
-                visited.append(v)
-                neighbours = list(graph[v])
-                for w in neighbours:
-                    queue.append(w)
-
-    # compare c_nodes with the ones visited with bfs algorithm
-    final_check = []
-    for v in c_nodes:
-        if v not in visited:
-            final_check.append(v)
-    if len(final_check) > 0:
-        return False
 
-    return True
+class GraphCheck(NamedTuple):
+
+    """ Result of the Eulerian check of a graph: whether it is valid, the
+    vertex where the euler path starts (None for a graph without edges)
+    and the out_degree - in_degree of every non compliant vertex """
+
+    valid: bool
+    start: object
+    imbalance: dict
+
+
+def _first_node(graph: nx.MultiDiGraph) -> int:
+    """ Helper function that returns the number of the node where the euler
+    path of a balanced graph starts: the first node added to a networkx
+    graph, or the node of the first kmer of a PackedGraph """
+    return graph.first_node if isinstance(graph, PackedGraph) else 0
+
+
+def _check_graph(graph: nx.MultiDiGraph) -> GraphCheck:
+
+    """ Helper function that checks in a single pass over the edges whether
+    a graph is Eulerian, and finds its start vertex. The result is cached
+    in graph.graph of a PackedGraph, which cannot change; a networkx graph
+    can, so its check is passed on by the callers instead """
+
+    packed = isinstance(graph, PackedGraph)
+    if packed and "euler_check" in graph.graph:
+        return graph.graph["euler_check"]
+
+    nodes, indptr, indices, counts = _adjacency(graph)
+    sources = np.repeat(np.arange(len(nodes)), np.diff(indptr))
+    out_degree = np.bincount(sources, weights=counts, minlength=len(nodes)).astype(np.int64)
+    in_degree = np.bincount(indices, weights=counts, minlength=len(nodes)).astype(np.int64)
+
+    # collect the non compliant vertices, those whose in_degree and
+    # out_degree differ
+    degree_diff = out_degree - in_degree
+    nc_ids = np.flatnonzero(degree_diff)
+    imbalance = {nodes[i]: int(degree_diff[i]) for i in nc_ids}
+
+    # the number of non compliant vertices must be 0 or 2, and in the
+    # latter case we start from the one that has the outgoing edge
+    start = None
+    valid = True
+    if len(nc_ids) == 2 and sorted(imbalance.values()) == [-1, 1]:
+        start = nc_ids[np.argmax(degree_diff[nc_ids])]
+    elif len(nc_ids) == 0:
+        if len(nodes) > 0:
+            start = _first_node(graph)
+    else:
+        valid = False
+
+    # check that all the vertices are weakly connected, with a union-find
+    # over the distinct edges (a single vertex without edges is valid, as
+    # in a compacted graph made of one unitig)
+    if valid and len(nodes) > 1:
+        parent = list(range(len(nodes)))
+
+        def find(v: int) -> int:
+            while parent[v] != v:
+                parent[v] = parent[parent[v]]
+                v = parent[v]
+            return v
+
+        for v, w in zip(sources.tolist(), indices.tolist()):
+            root_v = find(v)
+            root_w = find(w)
+            if root_v != root_w:
+                parent[root_v] = root_w
+
+        root = find(0)
+        valid = all(find(v) == root for v in range(1, len(nodes)))
+
+    if start is not None:
+        start = nodes[int(start)]
+    result = GraphCheck(valid, start if valid else None, imbalance)
+    if packed:
+        graph.graph["euler_check"] = result
+    return result
+
+
+@_profiled("compact_graph", lambda graph, *args: {"unitigs": graph.number_of_nodes()})
+def compact_graph(graph: nx.MultiDiGraph) -> nx.MultiDiGraph:
+
+    """ Function that collapses every non-branching chain of a graph into a
+    single unitig node that carries the sequence of the whole chain. An
+    edge is collapsed when it is the only edge leaving its source and the
+    only edge entering its target, and neither end can be where an euler
+    path starts or stops. Every euler path of the original graph then
+    walks each chain from start to end, and the compacted graph spells
+    the same sequence with construct_dna_sequence. Consecutive
+    unitigs overlap by k-2 nucleotides, which is stored in
+    graph.graph["overlap"] """
+
+    nodes, indptr, indices, counts = _adjacency(graph)
+    n_nodes = len(nodes)
+    sources = np.repeat(np.arange(n_nodes), np.diff(indptr))
+    out_degree = np.bincount(sources, weights=counts, minlength=n_nodes)
+    in_degree = np.bincount(indices, weights=counts, minlength=n_nodes)
+
+    # an euler path may start at a vertex with more outgoing edges (or at
+    # the first vertex of a balanced graph) and end at one with more
+    # incoming edges, so these must stay at the ends of their unitigs
+    merged = (counts == 1) & (out_degree[sources] == 1) & (in_degree[indices] == 1) & (sources != indices)
+    merged &= (out_degree[indices] <= in_degree[indices]) & (out_degree[sources] >= in_degree[sources])
+    first = _first_node(graph)
+    if (out_degree == in_degree).all():
+        merged &= indices != first
+    successor = np.full(n_nodes, -1, dtype=np.int64)
+    successor[sources[merged]] = indices[merged]
+    is_head = np.ones(n_nodes, dtype=bool)
+    is_head[indices[merged]] = False
+
+    # walk every chain from its head, the nodes that are left over form
+    # cycles of merged edges, which are broken at their first node
+    successor = successor.tolist()
+    unitig = [-1] * n_nodes
+    chains = []
+    # the unitig of the first node comes first, so that it is where the
+    # euler path of a balanced compacted graph starts
+    starts = [first] if n_nodes > 0 and is_head[first] else []
+    for v in starts + np.flatnonzero(is_head).tolist() + list(range(n_nodes)):
+        if unitig[v] != -1:
+            continue
+        is_head[v] = True
+        chain = [v]
+        unitig[v] = len(chains)
+        w = successor[v]
+        while w != -1 and w != v:
+            chain.append(w)
+            unitig[w] = len(chains)
+            w = successor[w]
+        chains.append(chain)
+
+    compacted = nx.MultiDiGraph(overlap=_overlap(graph, nodes))
+    labels = [_spell_path(graph, nodes, chain) for chain in chains]
+    compacted.add_nodes_from(labels)
+
+    # keep every edge that was not collapsed, between the unitigs of its ends
+    keep = ~merged | is_head[indices]
+    for v, w, count in zip(sources[keep].tolist(), indices[keep].tolist(), counts[keep].tolist()):
+        compacted.add_edges_from([(labels[unitig[v]], labels[unitig[w]])] * count)
+    return compacted
+
+
+def _overlap(graph: nx.MultiDiGraph, nodes: list) -> int:
+    """ Helper function that returns the number of nucleotides by which
+    consecutive nodes of a graph overlap"""
+
+    if isinstance(graph, PackedGraph):
+        return graph.k - 2
+    if "overlap" in graph.graph:
+        return graph.graph["overlap"]
+    return len(nodes[0]) - 1 if len(nodes) > 0 else 0
+
+
+@_profiled("is_valid_graph")
+def is_valid_graph(graph: nx.MultiDiGraph) -> bool:
+    """ Function that checks if a graph object is Eulerian"""
+    return _check_graph(graph).valid
 
 
 def _find_start(graph: nx.MultiDiGraph) -> int:
@@ -271,41 +1426,37 @@ def _find_start(graph: nx.MultiDiGraph) -> int:
     """ Helper function that finds the starting vertex of a given
     graph by taking into account the outgoing and ingoing connectivity
     """
-    nc_vertices = {}
 
-    for v in graph.nodes():
-        degree_diff = graph.out_degree(v) - graph.in_degree(v)
+    check = _check_graph(graph)
+    if not check.valid:
+        return False
+    return check.start
+
 
-        # complying to the in_degree and out_degree rule
-        if degree_diff == 0:
-            continue
-        else:
-            nc_vertices[v] = degree_diff
+def _adjacency(graph: nx.MultiDiGraph) -> tuple:
 
-    # we check if the dictionary with the non-compliant vertices
-    # has a length of 0 or 2
+    """ Helper function that numbers the nodes of a graph and returns them
+    together with its edges in CSR form: the successors of node i are
+    indices[indptr[i]:indptr[i + 1]] and counts holds the number of
+    parallel edges to each of them """
 
-    length = len(nc_vertices)
+    if isinstance(graph, PackedGraph):
+        return graph.nodes(), graph.indptr, graph.indices, graph.counts
 
-    if length != 0 and length != 2:
-        return False
+    nodes = list(graph.nodes())
+    ids = {v: i for i, v in enumerate(nodes)}
+    multigraph = graph.is_multigraph()
 
-    # if the length is 0 we start from any vertex
-    if length == 0:
-        for v in graph.nodes():
-            start_vertex = v
-            break
-    # if the length is 2 we need to start from the one that has the outgoing edge             
-    elif length == 2:
-        if 1 not in nc_vertices.values() or -1 not in nc_vertices.values():
-            return False
-        else:
-            for n, d in nc_vertices.items():
-                # we ensure that the starting node is with the outgoing edge
-                if d == 1:
-                    start_vertex = n
+    indptr = [0]
+    indices = []
+    counts = []
+    for v in nodes:
+        for w, keys in graph.succ[v].items():
+            indices.append(ids[w])
+            counts.append(len(keys) if multigraph else 1)
+        indptr.append(len(indices))
 
-    return start_vertex
+    return nodes, np.array(indptr), np.array(indices, dtype=np.int64), np.array(counts, dtype=np.int64)
 
 
 def _construct_euler_path(graph: nx.MultiDiGraph) -> list:
@@ -313,32 +1464,53 @@ def _construct_euler_path(graph: nx.MultiDiGraph) -> list:
     """ Helper function that builds the euler path of a given de Bruijn 
     graph """
 
-    nc_vertices = {}
+    nodes, euler_path = _euler_walk(graph)
 
-    for v in graph.nodes():
-        degree_diff = graph.out_degree(v) - graph.in_degree(v)
+    # convert the node numbers back to (k-1)mers
+    if isinstance(graph, PackedGraph):
+        return graph.labels(euler_path)
+    return [nodes[v] for v in euler_path]
 
-        # complying to the in_degree and out_degree rule
-        if degree_diff == 0:
-            continue
-        else:
-            nc_vertices[v] = degree_diff
 
-    start_vertex = _find_start(graph)
+@_profiled("euler_path", lambda walk, *args, **kwargs: {"path_length": len(walk[1])})
+def _euler_walk(graph: nx.MultiDiGraph, check: GraphCheck = None) -> tuple:
 
-    nbrs = {}
-    for v in graph.nodes():
-        nbrs[v] = list(graph[v])
+    """ Helper function that numbers the nodes of a graph and returns them
+    with the euler path as an array of node numbers. The result of
+    _check_graph can be passed as check if it is already known """
 
-    stack = [start_vertex]
-    euler_path = []
+    if check is None:
+        check = _check_graph(graph)
+    start_vertex = check.start
+    if start_vertex is None:
+        return [], []
+
+    nodes, indptr, indices, counts = _adjacency(graph)
+    if not isinstance(graph, PackedGraph):
+        start_vertex = nodes.index(start_vertex)
+
+    # every node keeps a pointer to its next unused successor and every
+    # successor the number of parallel edges still unused, so each step
+    # of the traversal takes O(1). The state is kept in arrays of 64-bit
+    # integers, which index as fast as lists and take 8 bytes per entry
+    # instead of about 36
+    pointer = _int_array(indptr[:-1])
+    end = _int_array(indptr[1:])
+    indices = _int_array(indices)
+    remaining = _int_array(counts)
+
+    stack = array.array("q", [start_vertex])
+    euler_path = array.array("q")
 
     # traverse the graph and extract the euler path
     while len(stack) > 0:
         v = stack[-1]
-        if len(nbrs[v]) > 0:
-            w = nbrs[v].pop(0)
-            stack.append(w)
+        i = pointer[v]
+        if i < end[v]:
+            remaining[i] -= 1
+            if remaining[i] == 0:
+                pointer[v] = i + 1
+            stack.append(indices[i])
         else:
             euler_path.append(stack.pop())
 
@@ -348,28 +1520,386 @@ def _construct_euler_path(graph: nx.MultiDiGraph) -> list:
 
     # dealing with the edge case where the graph is circular and ends at
     # the same vertex
-    if len(nc_vertices) == 0:
+    if len(check.imbalance) == 0 and len(euler_path) > 1:
         euler_path.pop()
 
-    return euler_path
+    return nodes, euler_path
+
+
+def _int_array(values: np.ndarray) -> array.array:
+    """ Helper function that copies a NumPy array to an array.array of
+    64-bit integers"""
+    result = array.array("q")
+    result.frombytes(np.ascontiguousarray(values, dtype=np.int64).tobytes())
+    return result
 
 
+@_profiled("construct_dna_sequence", lambda sequence, *args: {"length": len(sequence)})
 def construct_dna_sequence(graph: nx.MultiDiGraph) -> str:
     """ Function that constructs the sequence given an Eulerian graph """
+    return "".join(_iter_sequence_chunks(graph))
+
+
+def _iter_sequence_chunks(graph: nx.MultiDiGraph, batch: int = 1 << 16,
+                          check: GraphCheck = None, walk: tuple = None) -> Iterator[str]:
+
+    """ Helper function that yields the sequence of an Eulerian graph in
+    pieces, decoding batch nodes of the euler path at a time, so that the
+    sequence is never held as a whole (nothing is yielded for a graph
+    that is not Eulerian). The graph is checked once, unless the result
+    of _check_graph is passed as check, and traversed once, unless the
+    result of _euler_walk is passed as walk """
+
+    if walk is None:
+        if check is None:
+            check = _check_graph(graph)
+        if not check.valid:
+            return
+        walk = _euler_walk(graph, check)
+    nodes, euler_path = walk
+    if len(euler_path) == 0:
+        return
+    euler_path = np.frombuffer(euler_path, dtype=np.int64)
+
+    # consecutive nodes overlap by all but their last nucleotide (or by
+    # k-2 nucleotides for the unitigs of a compacted graph)
+    overlap = _overlap(graph, nodes)
+    if isinstance(graph, PackedGraph):
+        yield graph.label(euler_path[0])
+        # the last nucleotide of a (k-1)mer sits in its lowest 2 bits
+        for first in range(1, len(euler_path), batch):
+            codes = graph.kmers[euler_path[first:first + batch]] & np.uint64(3)
+            yield _BASES[codes].tobytes().decode("ascii")
+        return
+
+    yield nodes[euler_path[0]]
+    for first in range(1, len(euler_path), batch):
+        yield "".join(nodes[v][overlap:] for v in euler_path[first:first + batch].tolist())
+
+
+class Contig(NamedTuple):
+
+    """ A contig assembled from a maximal non-branching path: its sequence,
+    its length and its coverage, the mean multiplicity of its edges """
+
+    sequence: str
+    length: int
+    coverage: float
+
+
+def _spell_path(graph: nx.MultiDiGraph, nodes: list, path: list) -> str:
+    """ Helper function that spells the sequence of a path of node numbers,
+    the first (k-1)mer followed by the last nucleotide of every other (or
+    everything after the overlap for the unitigs of a compacted graph)"""
+
+    if isinstance(graph, PackedGraph):
+        last = _BASES[graph.kmers[np.asarray(path[1:], dtype=np.int64)] & np.uint64(3)]
+        return graph.label(path[0]) + last.tobytes().decode("ascii")
+    overlap = _overlap(graph, nodes)
+    return nodes[path[0]] + "".join(nodes[v][overlap:] for v in path[1:])
+
+
+@_profiled("construct_contigs", lambda contigs, *args: {"contigs": len(contigs)})
+def construct_contigs(graph: nx.MultiDiGraph) -> list:
+
+    """ Function that breaks a graph into its maximal non-branching paths
+    and returns them as a list of Contig, so that a graph that is not
+    Eulerian can still be assembled into pieces. A vertex is non-branching
+    when it has exactly one distinct predecessor and one distinct successor;
+    every path starts and ends at a branching vertex, except for isolated
+    cycles. Every edge is visited once, so this runs in linear time """
+
+    nodes, indptr, indices, counts = _adjacency(graph)
+    n_nodes = len(nodes)
+    simple = ((np.diff(indptr) == 1) & (np.bincount(indices, minlength=n_nodes) == 1)).tolist()
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    counts = counts.tolist()
+
+    paths = []
+    visited = [False] * n_nodes
+
+    # follow every edge that leaves a branching vertex until the next
+    # branching vertex
+    for v in range(n_nodes):
+        if simple[v]:
+            continue
+        for i in range(indptr[v], indptr[v + 1]):
+            path = [v]
+            coverage = [counts[i]]
+            w = indices[i]
+            while simple[w]:
+                visited[w] = True
+                path.append(w)
+                coverage.append(counts[indptr[w]])
+                w = indices[indptr[w]]
+            path.append(w)
+            paths.append((path, coverage))
+
+    # the non-branching vertices that were not reached form isolated cycles
+    for v in range(n_nodes):
+        if simple[v] and not visited[v]:
+            path = [v]
+            coverage = []
+            w = v
+            while True:
+                visited[w] = True
+                coverage.append(counts[indptr[w]])
+                w = indices[indptr[w]]
+                path.append(w)
+                if w == v:
+                    break
+            paths.append((path, coverage))
+
+    contigs = []
+    for path, coverage in paths:
+        sequence = _spell_path(graph, nodes, path)
+        contigs.append(Contig(sequence, len(sequence), sum(coverage) / len(coverage)))
+    return contigs
+
+
+class IncrementalAssembler:
+
+    """ Class that keeps the de Bruijn graph of the segments that arrived so
+    far and updates it in place as segments are added or retracted, so
+    that the cost of a batch grows with the batch and not with all the
+    segments before it.
+
+    Like clean_data, segments that fail its checks are ignored and a
+    sequence that occurs in several segments is only counted once: every
+    distinct sequence is fingerprinted with blake2b and its edges are in
+    the graph as long as one of its segments is. The out_degree -
+    in_degree of every non compliant vertex is updated with each edge, and
+    the connected components with a union-find while edges are only
+    added. check() then gives the Eulerian state and the start vertex
+    without a pass over the graph, which is only needed again once edges
+    have been retracted. Each batch must hold whole segments """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.graph = nx.MultiDiGraph()
+        self.sequences = {}
+        self.imbalance = {}
+        self._fingerprints = {}
+        self._copies = {}
+        self._parent = {}
+        self._components = 0
+        self._components_known = True
+
+    def add_segments(self, df: pd.DataFrame) -> int:
+        """ Function that cleans a batch of rows in the layout of the
+        DNA_[x]_[k].csv files and adds its segments to the graph. A segment
+        number that was added before is replaced. Returns the number of
+        segments that passed the checks """
+        return self.add_sequences(_sequencer(_drop_bad_segments(df)))
+
+    def add_sequences(self, sequences: Mapping) -> int:
+        """ Function that adds a {SegmentNr: sequence} dict of clean
+        segments to the graph and returns the number of segments"""
+
+        self.retract_segments([seg for seg in sequences if seg in self.sequences])
+        for seg, sequence in sequences.items():
+            fingerprint = hashlib.blake2b(sequence.encode("ascii"), digest_size=16).digest()
+            self.sequences[seg] = sequence
+            self._fingerprints[seg] = fingerprint
+            copies = self._copies.setdefault(fingerprint, set())
+            copies.add(seg)
+            if len(copies) == 1:
+                for kmer in _iter_kmers(sequence, self.k):
+                    self._add_edge(kmer[:-1], kmer[1:])
+        return len(sequences)
+
+    def retract_segments(self, segments: Iterable[int]) -> int:
+        """ Function that removes the given segments, and the edges of their
+        sequences unless another segment has the same sequence. Returns the
+        number of segments that were removed """
+
+        removed = 0
+        for seg in list(segments):
+            if seg not in self.sequences:
+                continue
+            sequence = self.sequences.pop(seg)
+            fingerprint = self._fingerprints.pop(seg)
+            copies = self._copies[fingerprint]
+            copies.discard(seg)
+            removed += 1
+            if len(copies) == 0:
+                del self._copies[fingerprint]
+                for kmer in _iter_kmers(sequence, self.k):
+                    self._remove_edge(kmer[:-1], kmer[1:])
+                self._components_known = False
+        return removed
+
+    def check(self) -> GraphCheck:
+
+        """ Function that returns the Eulerian check of the graph, as
+        _check_graph would, from the state kept up to date by every edge """
+
+        if not self._components_known:
+            self._rebuild_components()
+
+        nc = self.imbalance
+        start = None
+        valid = True
+        if len(nc) == 2 and sorted(nc.values()) == [-1, 1]:
+            start = next(v for v, diff in nc.items() if diff == 1)
+        elif len(nc) == 0:
+            start = next(iter(self.graph.nodes), None)
+        else:
+            valid = False
+        valid = valid and self._components <= 1
+
+        return GraphCheck(valid, start if valid else None, dict(nc))
+
+    def assemble(self) -> str:
+        """ Function that constructs the sequence of the current graph, or
+        returns '' when it is not Eulerian"""
+        return "".join(_iter_sequence_chunks(self.graph, check=self.check()))
+
+    def _add_edge(self, u: str, v: str):
+        for node in (u, v):
+            if node not in self._parent:
+                self._parent[node] = node
+                self._components += 1
+        self.graph.add_edge(u, v)
+        self._shift(u, 1)
+        self._shift(v, -1)
+        root_u = self._find(u)
+        root_v = self._find(v)
+        if root_u != root_v:
+            self._parent[root_u] = root_v
+            self._components -= 1
+
+    def _remove_edge(self, u: str, v: str):
+        self.graph.remove_edge(u, v)
+        self._shift(u, -1)
+        self._shift(v, 1)
+        # a fresh graph has no vertices without edges
+        for node in {u, v}:
+            if self.graph.degree(node) == 0:
+                self.graph.remove_node(node)
+
+    def _shift(self, node: str, diff: int):
+        value = self.imbalance.get(node, 0) + diff
+        if value == 0:
+            del self.imbalance[node]
+        else:
+            self.imbalance[node] = value
+
+    def _find(self, v: str) -> str:
+        parent = self._parent
+        while parent[v] != v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+
+    def _rebuild_components(self):
+        """ Helper function that builds the union-find again from the edges
+        of the graph, after edges were retracted """
+        self._parent = {node: node for node in self.graph.nodes}
+        self._components = len(self._parent)
+        for u, v in self.graph.edges():
+            root_u = self._find(u)
+            root_v = self._find(v)
+            if root_u != root_v:
+                self._parent[root_u] = root_v
+                self._components -= 1
+        self._components_known = True
+
+
+class SweepResult(NamedTuple):
+
+    """ Summary of the packed de Bruijn graph built for one k by sweep_k """
+
+    k: int
+    valid: bool
+    nodes: int
+    edges: int
+    contigs: int
+
+
+def _sequence_index(sequences: Iterable[str]) -> tuple:
+    """ Helper function that concatenates the 2-bit codes of all the
+    sequences into one array and returns it with the segment offsets"""
+
+    sequences = list(sequences)
+    lengths = [len(seq) for seq in sequences]
+    codes = _encode("".join(sequences))
+    return codes, np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+
+def _index_kmers(codes: np.ndarray, offsets: np.ndarray, k: int) -> np.ndarray:
+
+    """ Helper function that derives the packed kmers of every segment from
+    the shared sequence index, dropping the windows that start in one
+    segment and end in the next one """
+
+    kmers = _pack_codes(codes, k)
+    ends = np.repeat(offsets[1:], np.diff(offsets))[:len(kmers)]
+    return kmers[np.arange(len(kmers)) + k <= ends]
+
+
+def _assess_k(codes: np.ndarray, offsets: np.ndarray, k: int, min_count: int = 1) -> SweepResult:
+    """ Helper function that builds the packed graph of one k from the
+    sequence index and summarises it"""
 
-    # string where we will store our output
-    sequence = ''
+    kmers, counts = np.unique(_index_kmers(codes, offsets, k), return_counts=True)
+    keep = counts >= min_count
+    graph = PackedGraph.from_kmers(kmers[keep], k, counts[keep])
+    return SweepResult(k, is_valid_graph(graph), graph.number_of_nodes(),
+                       graph.number_of_edges(), len(construct_contigs(graph)))
 
-    if is_valid_graph(graph) is True:
 
-        euler_path = _construct_euler_path(graph)
+# sequence index of the sweep, memory-mapped once by every worker process
+_SWEEP_INDEX = None
 
-        # construct the sequence based on the euler path
-        if len(euler_path) > 0:
-            sequence = euler_path[0]
-            for kmer in euler_path[1:]:
-                sequence += kmer[-1]
-    return sequence
+
+def _init_sweep_worker(codes_name: str, offsets_name: str):
+    global _SWEEP_INDEX
+    _SWEEP_INDEX = (np.load(codes_name, mmap_mode="r"), np.load(offsets_name))
+
+
+def _assess_k_worker(k: int, min_count: int = 1) -> SweepResult:
+    return _assess_k(*_SWEEP_INDEX, k, min_count)
+
+
+def sweep_k(sequences: Iterable[str], ks: Iterable[int], workers: int = 1, min_count: int = 1) -> list:
+
+    """ Function that builds the packed de Bruijn graph of the given
+    sequences for every k in ks and returns a SweepResult for each. The
+    sequences are encoded once into a shared index from which the kmers
+    of every k are derived. With workers > 1 the values of k are spread
+    over a pool of processes that memory-map the index. Kmers that occur
+    fewer than min_count times are left out, as in construct_graph. Like
+    the packed graphs, the sweep needs values of k between 2 and 32 """
+
+    ks = list(ks)
+    if not all(2 <= k <= 32 for k in ks):
+        raise ValueError("A sweep needs values of k between 2 and 32")
+    codes, offsets = _sequence_index(sequences)
+    if workers <= 1 or len(ks) <= 1:
+        return [_assess_k(codes, offsets, k, min_count) for k in ks]
+
+    with tempfile.TemporaryDirectory() as directory:
+        codes_name = os.path.join(directory, "codes.npy")
+        offsets_name = os.path.join(directory, "offsets.npy")
+        np.save(codes_name, codes)
+        np.save(offsets_name, offsets)
+
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_sweep_worker,
+                                 initargs=(codes_name, offsets_name)) as pool:
+            return list(pool.map(_assess_k_worker, ks, [min_count] * len(ks)))
+
+
+def best_k(results: list) -> SweepResult:
+    """ Function that picks the best result of a sweep: the largest k with
+    an Eulerian graph or, if there is none, the one with the fewest
+    contigs (and then the largest k)"""
+
+    valid = [result for result in results if result.valid]
+    if valid:
+        return max(valid, key=lambda result: result.k)
+    return min(results, key=lambda result: (result.contigs, -result.k))
 
 
 def save_output(s: str, filename: str) -> str:
@@ -381,34 +1911,761 @@ def save_output(s: str, filename: str) -> str:
         with open(filename, 'w') as f:
             f.write(s)
 
+
+def write_sequence(graph: nx.MultiDiGraph, filename: str, fasta: bool = False, width: int = 60,
+                   name: str = "sequence", buffer_size: int = 1 << 20, batch: int = 1 << 16,
+                   walk: tuple = None) -> int:
+
+    """ Function that writes the sequence of an Eulerian graph to a file
+    while it is reconstructed, without building it in memory first. The
+    file is plain text like save_output, or with fasta=True a FASTA
+    record with the given name and lines of width nucleotides. A filename
+    ending with .gz is compressed with gzip. buffer_size sets the number of
+    bytes that are buffered before a write and batch the number of nodes
+    of the euler path that are decoded at a time. The result of
+    _euler_walk can be passed as walk if the graph was already traversed.
+    Returns the length of the sequence, which is 0 if it cannot be
+    constructed (and then no file is written) """
+
+    chunks = _iter_sequence_chunks(graph, batch=batch, walk=walk)
+    first = next(chunks, "")
+    if first == "":
+        print("The sequence cannot be constructed")
+        return 0
+
+    length = 0
+    # open() reads a buffering of 1 as line buffering, so it is unbuffered
+    with open(filename, "wb", buffering=buffer_size if buffer_size > 1 else 0) as raw:
+        f = gzip.GzipFile(fileobj=raw, mode="wb") if str(filename).endswith(".gz") else raw
+        if fasta:
+            f.write(f">{name}\n".encode("ascii"))
+
+        # with fasta, the part of a line that is left over waits for the
+        # next chunk
+        line = ""
+        for chunk in itertools.chain([first], chunks):
+            length += len(chunk)
+            if not fasta:
+                f.write(chunk.encode("ascii"))
+                continue
+            line += chunk
+            full = len(line) - len(line) % width
+            f.write("".join(line[i:i + width] + "\n" for i in range(0, full, width)).encode("ascii"))
+            line = line[full:]
+        if fasta and line:
+            f.write((line + "\n").encode("ascii"))
+        if f is not raw:
+            f.close()
+    return length
+
+
+def _print_path(graph: nx.MultiDiGraph, walk: tuple, batch: int = 1 << 16):
+    """ Helper function that prints the (k-1)mers of the euler path returned
+    by _euler_walk, separated by dashes, converting batch nodes at a time """
+
+    nodes, euler_path = walk
+    for first in range(0, len(euler_path), batch):
+        vs = euler_path[first:first + batch]
+        labels = graph.labels(vs) if isinstance(graph, PackedGraph) else [nodes[v] for v in vs]
+        print(" - ".join(labels), end=" - " if first + batch < len(euler_path) else "\n")
+
+
+def save_contigs(contigs: list, filename: str, width: int = 60):
+    """ Function that saves a list of contigs to a multi-record FASTA file,
+    with the length and coverage of each contig in its header"""
+
+    with open(filename, 'w') as f:
+        f.writelines(_fasta_lines(contigs, width))
+
+
+def _fasta_lines(contigs: list, width: int = 60) -> Iterator[str]:
+    """ Helper generator that yields the lines of the FASTA records of a
+    list of contigs"""
+
+    for i, contig in enumerate(contigs, start=1):
+        yield f">contig_{i} length={contig.length} coverage={contig.coverage:.2f}\n"
+        for start in range(0, contig.length, width):
+            yield contig.sequence[start:start + width] + "\n"
+
+
+# directory and size limit of the cache of cleaned sequences and graphs
+CACHE_DIR = os.environ.get("DNA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dna-assembly"))
+CACHE_SIZE = 1 << 30
+
+
+def _code_version() -> str:
+    """ Helper function that fingerprints the source of this module, so that
+    the cache entries of older versions of the code are never used"""
+    with open(__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def cache_key(name: str, k: int, min_count: int = 1, packed: bool = False, canonical: bool = False) -> str:
+    """ Function that returns the key of the cache entry of an input file,
+    from the hash of its content, k, the abundance threshold, the kind of
+    graph and the version of the code"""
+
+    digest = hashlib.sha256()
+    with open(name, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(f"{k}:{min_count}:{int(packed)}:{int(canonical)}:{_code_version()}".encode("ascii"))
+    return digest.hexdigest()
+
+
+def _save_graph(graph: nx.MultiDiGraph, name: str):
+
+    """ Helper function that serializes a graph to a .npz file. A PackedGraph
+    keeps its CSR arrays and a networkx graph is saved as its node labels
+    and an edge list of node numbers, in the order of the graph """
+
+    if isinstance(graph, PackedGraph):
+        np.savez(name, kmers=graph.kmers, indptr=graph.indptr, indices=graph.indices,
+                 counts=graph.counts, k=graph.k, first_node=graph.first_node)
+        return
+
+    labels = list(graph.nodes)
+    numbers = {node: i for i, node in enumerate(labels)}
+    edges = np.array([(numbers[u], numbers[v]) for u, v in graph.edges()], dtype=np.int64).reshape(-1, 2)
+    np.savez(name, labels=np.array(labels, dtype=str), edges=edges)
+
+
+def _load_graph(name: str) -> nx.MultiDiGraph:
+    """ Helper function that reads a graph saved by _save_graph"""
+
+    with np.load(name) as data:
+        if "kmers" in data:
+            return PackedGraph(data["kmers"], data["indptr"], data["indices"], data["counts"], int(data["k"]),
+                               int(data["first_node"]))
+
+        labels = data["labels"].tolist()
+        graph = nx.MultiDiGraph()
+        graph.add_nodes_from(labels)
+        graph.add_edges_from((labels[u], labels[v]) for u, v in data["edges"].tolist())
+        return graph
+
+
+def load_cached(key: str, directory: str = CACHE_DIR):
+
+    """ Function that returns the (sequences, graph) of a cache entry, or None
+    if there is no usable entry. The sequences are a PackedSequences, or
+    None if the entry was saved without them """
+
+    entry = os.path.join(directory, key)
+    try:
+        graph = _load_graph(os.path.join(entry, "graph.npz"))
+        sequences_name = os.path.join(entry, "sequences.npseq")
+        sequences = load_sequences(sequences_name) if os.path.exists(sequences_name) else None
+        # mark the entry as recently used for the eviction
+        os.utime(entry)
+    except (OSError, ValueError, KeyError):
+        return None
+    return sequences, graph
+
+
+def save_cached(key: str, graph: nx.MultiDiGraph, sequences: dict = None,
+                directory: str = CACHE_DIR, max_bytes: int = CACHE_SIZE):
+
+    """ Function that saves a graph, and optionally the {SegmentNr: sequence}
+    dict it was built from, to the cache under a given key. The least
+    recently used entries are then removed until the cache takes at most
+    max_bytes """
+
+    os.makedirs(directory, exist_ok=True)
+    # write to a temporary directory first so that no entry is ever half written
+    temporary = tempfile.mkdtemp(dir=directory, prefix=".tmp-")
+    try:
+        _save_graph(graph, os.path.join(temporary, "graph.npz"))
+        if sequences is not None:
+            save_sequences(sequences, os.path.join(temporary, "sequences.npseq"))
+        os.replace(temporary, os.path.join(directory, key))
+    except OSError:
+        # another run saved the same entry in the meantime
+        shutil.rmtree(temporary, ignore_errors=True)
+    _evict_cache(directory, max_bytes)
+
+
+def _evict_cache(directory: str, max_bytes: int):
+    """ Helper function that removes the least recently used cache entries
+    until the ones left take at most max_bytes"""
+
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_dir() and not entry.name.startswith(".tmp-"):
+            size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            entries.append((entry.stat().st_mtime, size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def _parse_name(name: str) -> tuple:
+    """ Helper function that extracts x and k from a file named
+    DNA_[x]_[k].csv or DNA_[x]_[k].npseq"""
+    result = os.path.splitext(os.path.basename(name))[0].split('_')
+    return int(result[1]), int(result[2])
+
+
+def _build_graph(input_file: str, k: int, stream: bool = False, unsorted: bool = False,
+                 chunksize: int = 1_000_000, workers: int = 1, cache: bool = True,
+                 min_count: int = 1, packed: bool = False, canonical: bool = False,
+                 sequences: dict = None) -> nx.MultiDiGraph:
+
+    """ Helper function that constructs the de Bruijn graph of a .csv or
+    .npseq file the way the command line does, reusing the cache of an
+    earlier run on the same .csv file and k unless cache is False. With
+    packed=True the graph is a PackedGraph and a .csv file is read and
+    cleaned with NumPy only, so pandas and networkx are never imported.
+    With canonical=True the segments are put on one strand first, which
+    needs all of them at once and so cannot be combined with stream.
+    Given the {SegmentNr: sequence} dict that was already cleaned from the
+    file, the graph is built from it instead of reading the file again """
+
+    if canonical and stream:
+        raise ValueError("Segments cannot be put on one strand while they are streamed")
+
+    # reuse the graph of an earlier run on the same file, k and code
+    key = None
+    if cache and not input_file.endswith(".npseq"):
+        key = cache_key(input_file, k, min_count, packed, canonical)
+        cached = load_cached(key)
+        if cached is not None:
+            return cached[1]
+
+    if sequences is not None:
+        graph = construct_graph(sequences, k, packed=packed, workers=workers, min_count=min_count,
+                                canonical=canonical)
+    elif input_file.endswith(".npseq"):
+        sequences = load_sequences(input_file)
+        graph = construct_graph(sequences, k, packed=packed, workers=workers, min_count=min_count,
+                                canonical=canonical)
+    elif stream:
+        sequences = iter_sequences(input_file, chunksize, presorted=not unsorted)
+        graph = _graph_from_sequences((seq for _, seq in sequences), k, packed=packed, min_count=min_count)
+        sequences = None
+    elif packed:
+        sequences = clean_rows(read_rows(input_file))
+        graph = construct_graph(sequences, k, packed=True, workers=workers, min_count=min_count,
+                                canonical=canonical)
+    else:
+        df = read_csv(input_file)
+        _, sequences = clean_data(df, return_sequences=True)
+        graph = construct_graph(sequences, k, workers=workers, min_count=min_count, canonical=canonical)
+
+    if key is not None:
+        save_cached(key, graph, sequences)
+    return graph
+
+
+class FileReport(NamedTuple):
+
+    """ Summary of the assembly of one file by assemble_batch. The peak
+    memory is the peak RSS of the process while the file was assembled
+    (see _peak_rss), and error is empty on success """
+
+    file: str
+    length: int
+    valid: bool
+    seconds: float
+    peak_memory: int
+    error: str
+
+
+def _assemble_file(input_file: str, k: int = None, output_dir: str = ".",
+                   compact: bool = False, **options) -> FileReport:
+
+    """ Helper function that assembles one file, saves DNA_[x].txt (and the
+    contigs of an invalid graph) to output_dir, and reports on it. An
+    error stops the assembly of the file and is recorded in the report """
+
+    _reset_peak_rss()
+    start = time.perf_counter()
+    length = 0
+    valid = False
+    error = ""
+    try:
+        x, file_k = _parse_name(input_file)
+        graph = _build_graph(input_file, k or file_k, **options)
+        if compact:
+            graph = compact_graph(graph)
+        valid = is_valid_graph(graph)
+        length = write_sequence(graph, os.path.join(output_dir, f"DNA_{x}.txt"))
+        if not valid:
+            save_contigs(construct_contigs(graph), os.path.join(output_dir, f"DNA_{x}_contigs.fasta"))
+    except Exception as exception:
+        error = f"{type(exception).__name__}: {exception}"
+    seconds = time.perf_counter() - start
+    return FileReport(input_file, length, valid, seconds, _peak_rss(), error)
+
+
+def _reset_peak_rss():
+    """ Helper function that resets the peak RSS of the process, which only
+    linux supports"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    """ Helper function that returns the peak RSS of the process in bytes,
+    since the last _reset_peak_rss on linux and since the start elsewhere.
+    Unlike tracemalloc this costs nothing while the pipeline runs """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    if resource is not None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return 0
+
+
+def assemble_batch(pattern: str, jobs: int = 1, **options) -> list:
+
+    """ Function that assembles every DNA_[x]_[k].csv or .npseq file of a
+    directory, or every file that matches a glob pattern, and returns a
+    FileReport for each of them. With jobs > 1 the files are spread over
+    a pool of processes, which import the modules once and then assemble
+    one file after another. The options are passed to _assemble_file """
+
+    if os.path.isdir(pattern):
+        names = sorted(glob.glob(os.path.join(pattern, "DNA_*_*.csv")) +
+                       glob.glob(os.path.join(pattern, "DNA_*_*.npseq")))
+    else:
+        names = sorted(glob.glob(pattern))
+
+    if jobs <= 1 or len(names) <= 1:
+        return [_assemble_file(name, **options) for name in names]
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_assemble_file, name, **options) for name in names]
+        reports = []
+        for name, future in zip(names, futures):
+            # a worker that dies takes its file down with it, not the batch
+            try:
+                reports.append(future.result())
+            except Exception as exception:
+                reports.append(FileReport(name, 0, False, 0.0, 0, f"{type(exception).__name__}: {exception}"))
+        return reports
+
+
+def save_report(reports: list, filename: str):
+    """ Function that saves the reports of assemble_batch to a .csv file"""
+    pd.DataFrame(reports, columns=FileReport._fields).to_csv(filename, index=False)
+
+
+# keep at most this many finished jobs of the job service, the oldest ones are forgotten
+SERVICE_KEEP = 1000
+
+# largest request body that the job service accepts, in bytes
+SERVICE_MAX_BODY = 1 << 26
+
+
+def _job_spec(payload: dict) -> dict:
+
+    """ Helper function that checks the body of a job submission and
+    returns the job to run: a csv file or inline segments, either rows of
+    COLUMNS or a {SegmentNr: sequence} dict, with k and the options of
+    construct_graph. The k of a csv file defaults to the k of its name """
+
+    if not isinstance(payload, dict) or ("csv" in payload) == ("segments" in payload):
+        raise ValueError("A job needs either a csv file or segments")
+    spec = {"packed": payload.get("packed", True), "canonical": payload.get("canonical", False),
+            "min_count": int(payload.get("min_count", 1)), "k": payload.get("k")}
+    # a JSON string such as "false" would be true, so only true and false are taken
+    for option in ("packed", "canonical"):
+        if not isinstance(spec[option], bool):
+            raise ValueError(f"{option} must be true or false")
+
+    if "csv" in payload:
+        spec["csv"] = str(payload["csv"])
+        if not os.path.isfile(spec["csv"]):
+            raise ValueError(f"No such file: {spec['csv']}")
+        if spec["k"] is None:
+            spec["k"] = _parse_name(spec["csv"])[1]
+    elif isinstance(payload["segments"], (dict, list)):
+        spec["segments"] = payload["segments"]
+    else:
+        raise ValueError("The segments must be a list of rows or a {SegmentNr: sequence} object")
+
+    if not isinstance(spec["k"], int) or spec["k"] < 2:
+        raise ValueError("k must be an integer of at least 2")
+    if spec["min_count"] < 1:
+        raise ValueError("min_count must be at least 1")
+    return spec
+
+
+def _run_job(spec: dict) -> dict:
+
+    """ Helper function that assembles a job of the job service in a worker
+    process and returns its result. The segments are cleaned with NumPy
+    only, so the workers do not import pandas """
+
+    start = time.perf_counter()
+    if "csv" in spec:
+        sequences = clean_rows(read_rows(spec["csv"]))
+    elif isinstance(spec["segments"], dict):
+        sequences = spec["segments"]
+    else:
+        sequences = clean_rows(np.array(spec["segments"], dtype=np.int64).reshape(-1, len(COLUMNS)))
+
+    graph = construct_graph(sequences, spec["k"], packed=spec["packed"], min_count=spec["min_count"],
+                            canonical=spec["canonical"])
+    valid = is_valid_graph(graph)
+    sequence = construct_dna_sequence(graph)
+    contigs = [] if valid else construct_contigs(graph)
+    return {"valid": valid, "length": len(sequence), "contigs": len(contigs),
+            "seconds": time.perf_counter() - start, "sequence": sequence, "contig_records": contigs}
+
+
+class JobService:
+
+    """ Long-running service that assembles jobs sent over HTTP, so that
+    every job skips the start of the interpreter and the imports. The jobs
+    run on a pool of worker processes and wait in a queue of at most
+    max_queue jobs; a job that arrives when the queue is full is turned
+    away with 503, so the client can retry later. The endpoints are:
+
+        POST /jobs                  submit {"csv": file} or {"segments": ...} with k
+                                    and the options of construct_graph
+        GET /jobs                   status of every job
+        GET /jobs/{id}              status of a job
+        GET /jobs/{id}/sequence     assembled sequence of a finished job
+        GET /jobs/{id}/contigs      contigs of a finished job, in FASTA format
+        GET /health                 number of queued and running jobs
+
+    A status has the fields id, status (queued, running, done or failed),
+    k, the submitted, started and finished times, and for a finished job
+    valid, length, contigs, seconds or error """
+
+    def __init__(self, workers: int = 1, max_queue: int = 16, keep: int = SERVICE_KEEP):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.keep = keep
+        self.jobs = {}
+        self._results = {}
+        self._ids = itertools.count(1)
+        self._queue = None
+        self._pool = None
+        self._consumers = []
+        self._server = None
+
+    @property
+    def port(self) -> int:
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.Server:
+        """ Function that starts the workers and listens on host and port,
+        any free port with port=0 """
+
+        self._queue = asyncio.Queue(self.max_queue)
+        self._pool = self._new_pool()
+        self._consumers = [asyncio.create_task(self._consume()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server
+
+    async def close(self):
+        """ Function that stops listening, cancels the queued jobs and stops
+        the workers """
+
+        self._server.close()
+        await self._server.wait_closed()
+        for consumer in self._consumers:
+            consumer.cancel()
+        await asyncio.gather(*self._consumers, return_exceptions=True)
+        # waiting for the running jobs would block the event loop
+        await asyncio.to_thread(self._pool.shutdown, cancel_futures=True)
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        """ Helper function that creates the pool of workers. They are
+        spawned rather than forked, so that they do not inherit the open
+        connections of the service, which would then never be closed """
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, spec: dict) -> dict:
+        """ Function that queues a job returned by _job_spec and returns its
+        status, or raises asyncio.QueueFull if the queue is full """
+
+        job = {"id": str(next(self._ids)), "status": "queued", "k": spec["k"],
+               "submitted": time.time(), "started": None, "finished": None}
+        self._queue.put_nowait((job["id"], spec))
+        self.jobs[job["id"]] = job
+        self._forget()
+        return job
+
+    def _forget(self):
+        """ Helper function that drops the oldest finished jobs beyond keep"""
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in ("done", "failed")]
+        for job_id in finished[:max(0, len(self.jobs) - self.keep)]:
+            del self.jobs[job_id]
+            self._results.pop(job_id, None)
+
+    async def _consume(self):
+        """ Helper function that runs the queued jobs one after another on the
+        pool, as one of workers consumers """
+
+        loop = asyncio.get_running_loop()
+        while True:
+            job_id, spec = await self._queue.get()
+            job = self.jobs[job_id]
+            job.update(status="running", started=time.time())
+            pool = self._pool
+            try:
+                result = await loop.run_in_executor(pool, _run_job, spec)
+            except BrokenProcessPool as exception:
+                # a worker died, for example out of memory: the job fails and
+                # the next ones run on a new pool, which only the first of the
+                # consumers whose jobs were on the broken pool creates
+                if self._pool is pool:
+                    pool.shutdown(wait=False)
+                    self._pool = self._new_pool()
+                job.update(status="failed", error=f"{type(exception).__name__}: {exception}")
+            except Exception as exception:
+                job.update(status="failed", error=f"{type(exception).__name__}: {exception}")
+            else:
+                self._results[job_id] = (result.pop("sequence"), result.pop("contig_records"))
+                job.update(status="done", **result)
+            job["finished"] = time.time()
+            self._queue.task_done()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ Helper function that answers one HTTP request and closes the
+        connection """
+
+        try:
+            method, target, _ = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length", 0))
+            if length > SERVICE_MAX_BODY:
+                status, body = HTTPStatus.REQUEST_ENTITY_TOO_LARGE, {"error": "The request is too large"}
+            else:
+                status, body = self._route(method, target, await reader.readexactly(length))
+        except (ValueError, asyncio.IncompleteReadError):
+            status, body = HTTPStatus.BAD_REQUEST, {"error": "Malformed request"}
+        except Exception as exception:
+            # the connection is still answered, so the client does not hang
+            status, body = HTTPStatus.INTERNAL_SERVER_ERROR, {"error": f"{type(exception).__name__}: {exception}"}
+
+        if isinstance(body, str):
+            content, content_type = body.encode("ascii"), "text/plain"
+        else:
+            content, content_type = json.dumps(body).encode("ascii"), "application/json"
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(content)}\r\nConnection: close\r\n")
+        if status == HTTPStatus.SERVICE_UNAVAILABLE:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("ascii") + b"\r\n" + content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    def _route(self, method: str, target: str, content: bytes) -> tuple:
+        """ Helper function that returns the status and the body of the
+        response to a request """
+
+        parts = target.split("?")[0].strip("/").split("/")
+        if method == "GET" and parts == ["health"]:
+            running = sum(1 for job in self.jobs.values() if job["status"] == "running")
+            return HTTPStatus.OK, {"queued": self._queue.qsize(), "running": running,
+                                   "workers": self.workers, "max_queue": self.max_queue}
+        if parts[0] != "jobs" or len(parts) > 3:
+            return HTTPStatus.NOT_FOUND, {"error": f"No such endpoint: {target}"}
+
+        if len(parts) == 1:
+            if method == "GET":
+                return HTTPStatus.OK, list(self.jobs.values())
+            if method != "POST":
+                return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} is not allowed on /jobs"}
+            try:
+                spec = _job_spec(json.loads(content))
+            except (ValueError, TypeError) as exception:
+                return HTTPStatus.BAD_REQUEST, {"error": str(exception)}
+            try:
+                return HTTPStatus.ACCEPTED, self.submit(spec)
+            except asyncio.QueueFull:
+                return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "The queue is full, try again later"}
+
+        job = self.jobs.get(parts[1])
+        if method != "GET":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": f"{method} is not allowed on {target}"}
+        if job is None:
+            return HTTPStatus.NOT_FOUND, {"error": f"No such job: {parts[1]}"}
+        if len(parts) == 2:
+            return HTTPStatus.OK, job
+        if parts[2] not in ("sequence", "contigs"):
+            return HTTPStatus.NOT_FOUND, {"error": f"No such endpoint: {target}"}
+        if job["status"] != "done":
+            return HTTPStatus.CONFLICT, {"error": f"Job {job['id']} is {job['status']}"}
+
+        sequence, contigs = self._results[job["id"]]
+        if parts[2] == "sequence":
+            return HTTPStatus.OK, sequence
+        return HTTPStatus.OK, "".join(_fasta_lines(contigs))
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8000, workers: int = 1, max_queue: int = 16):
+    """ Function that runs a JobService on host and port until it is
+    interrupted """
+
+    service = JobService(workers, max_queue)
+    server = await service.start(host, port)
+    print(f"Assembling jobs on http://{host}:{service.port} with {workers} workers")
+    try:
+        await server.serve_forever()
+    finally:
+        await service.close()
+
+
 # run the program through the command line
 
 
 if __name__ == "__main__":
 
-    argv = os.sys.argv
-    input_file = argv[1]
-
-    result = input_file.rstrip(".csv")
-    result = result.split('_')
-
-    # extract x and k
-    x = int(result[1])
-    k = int(result[2])
-
-    # build the pipeline for running in command line
-    df = read_csv(input_file)
-    df_cleaned = clean_data(df)
-    json_sequences = generate_sequences(df_cleaned)
-    graph_object = construct_graph(json_sequences, k)
-    filename = f"DNA_{x}.png"
-    graph_image = plot_graph(graph_object, filename)
-    sequence = construct_dna_sequence(graph_object)
-    euler_path = _construct_euler_path(graph_object)
-    if is_valid_graph(graph_object) is True:
-        for i, kmer in enumerate(euler_path):
-            if i < len(euler_path) - 1:
-                print(f"{kmer} -", end=' ')
+    parser = argparse.ArgumentParser(description="Assemble a DNA sequence from a DNA_[x]_[k].csv file")
+    parser.add_argument("input_file", nargs="?", help="csv file named DNA_[x]_[k].csv, or a packed DNA_[x]_[k].npseq file, "
+                                           "or a directory or glob pattern of such files to assemble as a batch")
+    parser.add_argument("-k", type=int, help="length of the kmers, instead of the k in the file name")
+    parser.add_argument("--convert", action="store_true",
+                        help="only clean the csv and save its sequences to DNA_[x]_[k].npseq")
+    parser.add_argument("--stream", action="store_true",
+                        help="read the csv in chunks instead of loading it at once")
+    parser.add_argument("--unsorted", action="store_true",
+                        help="with --stream, sort the csv externally because its rows are not grouped by segment")
+    parser.add_argument("--chunksize", type=int, default=1_000_000,
+                        help="number of csv rows per chunk with --stream")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="number of processes that construct the graph")
+    parser.add_argument("--packed", action="store_true",
+                        help="construct a compact graph of packed kmers, without pandas and networkx")
+    parser.add_argument("--canonical", action="store_true",
+                        help="put the segments on one strand first, for files with segments of both strands")
+    parser.add_argument("--min-count", type=int, default=1,
+                        help="drop the kmers that occur fewer times, such as the ones around sequencing errors")
+    parser.add_argument("--sweep", metavar="START:STOP",
+                        help="try every k from START to STOP and assemble with the best one")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="clean the csv and construct the graph again instead of using the cache")
+    parser.add_argument("--plot", action="store_true",
+                        help="draw the graph to DNA_[x].png, at a lower level of detail for large graphs")
+    parser.add_argument("--export", metavar="FILE",
+                        help="save the graph to a .graphml or .gfa file for external viewers")
+    parser.add_argument("--compact", action="store_true",
+                        help="collapse non-branching chains into unitigs before the traversal")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="save the time, memory and item counts of every stage to a JSON file (- for stdout)")
+    parser.add_argument("--fasta", action="store_true",
+                        help="save the sequence as a FASTA record to DNA_[x].fasta instead of DNA_[x].txt")
+    parser.add_argument("--gzip", action="store_true",
+                        help="compress the sequence file with gzip")
+    parser.add_argument("--buffer-size", type=int, default=1 << 20,
+                        help="number of bytes of the sequence that are buffered before a write")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="number of files of a batch that are assembled at the same time")
+    parser.add_argument("--output-dir", default=".",
+                        help="directory where a batch saves the sequences and contigs")
+    parser.add_argument("--report", default="batch_report.csv",
+                        help="file where a batch saves the summary of every file")
+    parser.add_argument("--serve", metavar="[HOST:]PORT",
+                        help="instead of an input file, assemble the jobs sent over HTTP, on --jobs worker processes")
+    parser.add_argument("--queue", type=int, default=16,
+                        help="number of jobs that wait for a worker before new jobs are turned away")
+    args = parser.parse_args()
+    input_file = args.input_file
+
+    if args.serve:
+        host, _, port = args.serve.rpartition(":")
+        try:
+            asyncio.run(serve(host or "127.0.0.1", int(port), workers=args.jobs, max_queue=args.queue))
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit
+    if input_file is None:
+        parser.error("the input_file is required unless --serve is given")
+    if args.sweep:
+        try:
+            start, stop = (int(value) for value in args.sweep.split(":"))
+        except ValueError:
+            parser.error("--sweep needs START:STOP, such as 15:31")
+        if not 2 <= start <= stop <= 32:
+            parser.error("--sweep needs 2 <= START <= STOP <= 32, the largest k of a packed graph")
+
+    if os.path.isdir(input_file) or any(c in input_file for c in "*?["):
+        reports = assemble_batch(input_file, jobs=args.jobs, k=args.k, output_dir=args.output_dir,
+                                 compact=args.compact, stream=args.stream, unsorted=args.unsorted,
+                                 chunksize=args.chunksize, workers=args.workers, cache=not args.no_cache,
+                                 min_count=args.min_count, packed=args.packed, canonical=args.canonical)
+        save_report(reports, args.report)
+        failed = sum(1 for report in reports if report.error)
+        print(f"Assembled {len(reports) - failed} of {len(reports)} files, saved the report to {args.report}")
+        raise SystemExit(1 if failed else 0)
+
+    # record the stages of the pipeline with --profile
+    with profile() if args.profile else nullcontext() as recorded:
+        # extract x and k
+        x, k = _parse_name(input_file)
+        k = args.k if args.k is not None else k
+
+        # --convert only saves the sequences, the block is left normally so that the profile is saved
+        if args.convert:
+            print(f"Saved the sequences to {convert_csv(input_file)}")
+        else:
+            # the sequences that the sweep cleaned are assembled without reading the file again
+            sweep_sequences = None
+            if args.sweep:
+                if input_file.endswith(".npseq"):
+                    sweep_sequences = load_sequences(input_file)
+                elif args.packed:
+                    sweep_sequences = clean_rows(read_rows(input_file))
+                else:
+                    sweep_sequences = clean_data(read_csv(input_file), return_sequences=True)[1]
+
+                results = sweep_k(sweep_sequences.values(), range(start, stop + 1), workers=args.workers,
+                                  min_count=args.min_count)
+                print(f"{'k':>4} {'valid':>6} {'nodes':>10} {'edges':>10} {'contigs':>8}")
+                for result in results:
+                    print(f"{result.k:>4} {str(result.valid):>6} {result.nodes:>10} {result.edges:>10} {result.contigs:>8}")
+                k = best_k(results).k
+                print(f"Assembling with k = {k}")
+
+            graph_object = _build_graph(input_file, k, stream=args.stream, unsorted=args.unsorted,
+                                        chunksize=args.chunksize, workers=args.workers, cache=not args.no_cache,
+                                        min_count=args.min_count, packed=args.packed, canonical=args.canonical,
+                                        sequences=sweep_sequences)
+            if args.compact:
+                graph_object = compact_graph(graph_object)
+            if args.plot:
+                plot_graph(graph_object, f"DNA_{x}.png")
+            if args.export:
+                export_graph(graph_object, args.export)
+            output = f"DNA_{x}.fasta" if args.fasta else f"DNA_{x}.txt"
+            output = output + ".gz" if args.gzip else output
+            if is_valid_graph(graph_object) is True:
+                # one traversal gives both the printed path and the sequence
+                walk = _euler_walk(graph_object)
+                _print_path(graph_object, walk)
+                write_sequence(graph_object, output, fasta=args.fasta, name=f"DNA_{x}", buffer_size=args.buffer_size,
+                               walk=walk)
             else:
-                print(kmer)
-        save_output(sequence, f"DNA_{x}.txt")
+                # assemble the non-branching stretches of the graph instead
+                write_sequence(graph_object, output, fasta=args.fasta, name=f"DNA_{x}", buffer_size=args.buffer_size)
+                contigs = construct_contigs(graph_object)
+                save_contigs(contigs, f"DNA_{x}_contigs.fasta")
+                print(f"Saved {len(contigs)} contigs to DNA_{x}_contigs.fasta")
+
+    if args.profile == "-":
+        print(recorded.to_json())
+    elif args.profile:
+        with open(args.profile, "w") as f:
+            f.write(recorded.to_json())
@@ -0,0 +1,544 @@
+
+"""
+Benchmarks for the assembly pipeline of project.py
+
+Run with: python project_bench.py [benchmark]
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from project import (COLUMNS, IncrementalAssembler, JobService, _construct_euler_path, _encode, _sequencer,
+                     clean_data, compact_graph, clean_rows, construct_dna_sequence, construct_graph, convert_csv,
+                     load_sequences, read_csv, read_rows, save_output, write_sequence)
+
+
+def _sequencer_loop(df: pd.DataFrame) -> dict:
+    """ Reference copy of the row by row _sequencer, kept to measure the
+    vectorized decoder against it """
+
+    sequences = {}
+    for seg in df["SegmentNr"].unique():
+        seg_df = df.loc[df["SegmentNr"] == seg]
+        seq_temp = []
+        for A, C, G, T in zip(seg_df["A"], seg_df["C"], seg_df["G"], seg_df["T"]):
+            if A == 1:
+                seq_temp.append("A")
+            elif C == 1:
+                seq_temp.append("C")
+            elif G == 1:
+                seq_temp.append("G")
+            elif T == 1:
+                seq_temp.append("T")
+        sequences[int(seg)] = "".join(seq_temp)
+    return sequences
+
+
+def _clean_data_loop(df: pd.DataFrame) -> pd.DataFrame:
+    """ Reference copy of the per-segment clean_data loop, kept to measure
+    the vectorized engine against it """
+
+    bad_idx = []
+    clean_df = df.drop_duplicates(subset=["SegmentNr", "Position", "A", "C", "G", "T"], keep="first")
+    clean_df = (clean_df.sort_values(["SegmentNr", "Position"])
+                .reset_index(drop=True))
+
+    for seg in clean_df["SegmentNr"].unique():
+        seg_df = clean_df.loc[clean_df["SegmentNr"] == seg]
+        if len(seg_df["Position"]) != seg_df["Position"].max():
+            bad_idx.extend(seg_df.index.tolist())
+            continue
+        if seg_df.duplicated(subset=["Position"], keep=False).any():
+            bad_idx.extend(seg_df.index.tolist())
+            continue
+        if (seg_df[["A", "C", "G", "T"]].sum(axis=1) != 1).any():
+            bad_idx.extend(seg_df.index.tolist())
+            continue
+
+    clean_df = clean_df.drop(index=bad_idx).reset_index(drop=True)
+
+    seen = set()
+    bad_seq = []
+    for key, value in _sequencer_loop(clean_df).items():
+        if value in seen:
+            bad_seq.extend(clean_df.loc[clean_df["SegmentNr"] == key].index.tolist())
+        else:
+            seen.add(value)
+
+    clean_df = clean_df.drop(index=bad_seq).reset_index(drop=True)
+    return clean_df.sort_values(["SegmentNr", "Position"])
+
+
+def random_segments(n_segments: int, length: int = 8, seed: int = 0) -> pd.DataFrame:
+    """ Function that creates a dataframe with n_segments random segments of
+    a given length, where about one segment in ten has a multi-hot row """
+
+    rng = np.random.default_rng(seed)
+    n_rows = n_segments * length
+
+    segments = np.repeat(np.arange(1, n_segments + 1), length)
+    positions = np.tile(np.arange(1, length + 1), n_segments)
+    onehot = np.zeros((n_rows, 4), dtype=np.int64)
+    onehot[np.arange(n_rows), rng.integers(0, 4, n_rows)] = 1
+
+    # corrupt a few rows so the cleaning has work to do
+    corrupt = rng.choice(n_rows, size=n_segments // 10, replace=False)
+    onehot[corrupt] = 1
+
+    data = np.column_stack([segments, positions, onehot])
+    return pd.DataFrame(data, columns=["SegmentNr", "Position", "A", "C", "G", "T"])
+
+
+def random_sequences(n_kmers: int, k: int, segment_length: int = 100, seed: int = 0) -> dict:
+    """ Function that cuts a random genome into segments that overlap by
+    k-1 nucleotides, so that the sequences hold about n_kmers kmers """
+
+    rng = np.random.default_rng(seed)
+    step = segment_length - k + 1
+    genome = np.frombuffer(b"ACGT", dtype=np.uint8)[rng.integers(0, 4, n_kmers + k - 1)]
+    genome = genome.tobytes().decode("ascii")
+
+    return {i + 1: genome[start:start + segment_length]
+            for i, start in enumerate(range(0, n_kmers, step))}
+
+
+def random_genome(length: int, seed: int = 0) -> str:
+    """ Function that creates a random genome of a given length"""
+    codes = np.random.default_rng(seed).integers(0, 4, length)
+    return np.frombuffer(b"ACGT", dtype=np.uint8)[codes].tobytes().decode("ascii")
+
+
+def simulate_segments(genome: str, segment_length: int = 100, coverage: float = 10.0, seed: int = 0,
+                      missing: float = 0.0, conflicts: float = 0.0, multihot: float = 0.0,
+                      duplicates: float = 0.0, reverse: float = 0.0) -> pd.DataFrame:
+
+    """ Function that samples segments of a genome at random positions until
+    every nucleotide is covered coverage times on average, and returns them
+    as shuffled rows in the layout of the DNA_[x]_[k].csv files. The other
+    arguments are the fractions of segments that get each kind of error
+    that clean_data removes: a missing position, a second row with a
+    different nucleotide at the same position, a multi-hot row, or a copy
+    under another segment number. A fraction reverse of the segments is
+    read from the opposite strand """
+
+    rng = np.random.default_rng(seed)
+    n_segments = max(1, int(round(coverage * len(genome) / segment_length)))
+    starts = rng.integers(0, len(genome) - segment_length + 1, n_segments)
+
+    # copies of the sequences of random segments under new numbers
+    starts = np.concatenate((starts, rng.choice(starts, int(duplicates * n_segments))))
+    n_segments = len(starts)
+
+    codes = _encode(genome)
+    segments = np.repeat(np.arange(1, n_segments + 1), segment_length)
+    positions = np.tile(np.arange(1, segment_length + 1), n_segments)
+    bases = codes[(starts[:, None] + np.arange(segment_length)).ravel()]
+
+    # segments of the opposite strand are reverse complemented
+    if reverse:
+        bases = bases.reshape(n_segments, segment_length)
+        flipped = rng.random(n_segments) < reverse
+        bases[flipped] = 3 - bases[flipped, ::-1]
+        bases = bases.ravel()
+    onehot = np.eye(4, dtype=np.int64)[bases]
+
+    # each error hits its own segments, at a random position of each
+    errors = rng.permutation(n_segments)
+    n_missing, n_conflicts, n_multihot = (int(rate * n_segments) for rate in (missing, conflicts, multihot))
+
+    def rows(chosen: np.ndarray) -> np.ndarray:
+        return chosen * segment_length + rng.integers(0, segment_length, len(chosen))
+
+    multihot_rows = rows(errors[n_missing + n_conflicts:n_missing + n_conflicts + n_multihot])
+    onehot[multihot_rows] = 1
+
+    data = np.column_stack([segments, positions, onehot])
+    conflict_rows = data[rows(errors[n_missing:n_missing + n_conflicts])]
+    conflict_rows[:, 2:] = np.roll(conflict_rows[:, 2:], 1, axis=1)
+    data = np.delete(data, rows(errors[:n_missing]), axis=0)
+    data = np.concatenate((data, conflict_rows))
+
+    df = pd.DataFrame(data[rng.permutation(len(data))], columns=COLUMNS)
+    return df
+
+
+def write_csv(df: pd.DataFrame, directory: str, x: int, k: int) -> str:
+    """ Function that saves the rows of simulate_segments to DNA_[x]_[k].csv
+    in a given directory and returns the name of the file """
+    name = os.path.join(directory, f"DNA_{x}_{k}.csv")
+    df.to_csv(name, header=False, index=False)
+    return name
+
+
+def _measured(func, *args, **kwargs) -> tuple:
+    """ Helper function that returns the result of a call and the memory
+    that it still holds once it has returned """
+    tracemalloc.start()
+    result = func(*args, **kwargs)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current
+
+
+def _peak(func, *args) -> int:
+    """ Helper function that returns the largest amount of memory that a
+    call has allocated at once """
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def _timed(func, *args) -> tuple:
+    """ Helper function that returns the result and the wall time of a call """
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def bench_clean_data(sizes=(10_000, 100_000, 1_000_000), loop_limit: int = 10_000):
+    """ Function that compares the vectorized clean_data with the per-segment
+    loop. The loop is quadratic, so it only runs up to loop_limit segments """
+
+    print(f"{'segments':>10} {'vectorized [s]':>15} {'loop [s]':>10}")
+    for n in sizes:
+        df = random_segments(n)
+        fast, fast_time = _timed(clean_data, df)
+
+        if n <= loop_limit:
+            slow, slow_time = _timed(_clean_data_loop, df)
+            assert fast.equals(slow)
+            loop = f"{slow_time:10.3f}"
+        else:
+            loop = f"{'skipped':>10}"
+
+        print(f"{n:>10} {fast_time:15.3f} {loop}")
+
+
+def bench_sequencer(sizes=(10_000, 100_000, 1_000_000), loop_limit: int = 10_000):
+    """ Function that measures the decoding rate of _sequencer in rows per
+    second and compares it with the row by row loop """
+
+    print(f"{'segments':>10} {'rows/s':>14} {'loop rows/s':>14}")
+    for n in sizes:
+        df = random_segments(n)
+        fast, fast_time = _timed(_sequencer, df)
+
+        if n <= loop_limit:
+            slow, slow_time = _timed(_sequencer_loop, df)
+            assert fast == slow
+            loop = f"{len(df) / slow_time:14,.0f}"
+        else:
+            loop = f"{'skipped':>14}"
+
+        print(f"{n:>10} {len(df) / fast_time:14,.0f} {loop}")
+
+
+def bench_graph_memory(sizes=(10_000, 100_000, 1_000_000), k: int = 21, nx_limit: int = 100_000):
+    """ Function that compares the memory held by the networkx graph and by
+    the PackedGraph, in bytes per edge """
+
+    print(f"{'edges':>10} {'packed B/edge':>14} {'networkx B/edge':>16}")
+    for n in sizes:
+        json_data = json.dumps(random_sequences(n, k))
+        graph, packed_bytes = _measured(construct_graph, json_data, k, packed=True)
+        edges = graph.number_of_edges()
+
+        if n <= nx_limit:
+            _, nx_bytes = _measured(construct_graph, json_data, k)
+            networkx = f"{nx_bytes / edges:16.1f}"
+        else:
+            networkx = f"{'skipped':>16}"
+
+        print(f"{edges:>10} {packed_bytes / edges:14.1f} {networkx}")
+
+
+def bench_parallel_graph(workers=(1, 2, 4, 8), n_kmers: int = 4_000_000, k: int = 21):
+    """ Function that measures how construct_graph scales with the number of
+    worker processes on a synthetic genome, for both graph backends. The
+    networkx graph is built on a tenth of the genome """
+
+    print(f"{'workers':>8} {'packed [s]':>11} {'networkx [s]':>13}")
+    packed_data = json.dumps(random_sequences(n_kmers, k))
+    nx_data = json.dumps(random_sequences(n_kmers // 10, k))
+    for n in workers:
+        _, packed_time = _timed(construct_graph, packed_data, k, True, n)
+        _, nx_time = _timed(construct_graph, nx_data, k, False, n)
+        print(f"{n:>8} {packed_time:11.3f} {nx_time:13.3f}")
+
+
+def bench_euler_path(sizes=(100_000, 1_000_000, 10_000_000), k: int = 25):
+    """ Function that measures _construct_euler_path on the packed graph of
+    a single random genome, in edges per second """
+
+    print(f"{'edges':>10} {'time [s]':>9} {'edges/s':>12}")
+    for n in sizes:
+        graph = construct_graph(json.dumps(random_sequences(n, k, segment_length=n + k)), k, packed=True)
+        path, path_time = _timed(_construct_euler_path, graph)
+        assert len(path) == graph.number_of_edges() + 1
+        print(f"{graph.number_of_edges():>10} {path_time:9.3f} {graph.number_of_edges() / path_time:12,.0f}")
+
+
+def bench_compaction(sizes=(100_000, 1_000_000), k: int = 31):
+    """ Function that compares the node count, memory and assembly time of
+    the packed graph of a random genome with those of its compacted graph """
+
+    print(f"{'edges':>10} {'nodes':>10} {'unitigs':>8} {'compact [s]':>12} "
+          f"{'assemble [s]':>13} {'compacted [s]':>14} {'unitig MB':>10}")
+    for n in sizes:
+        graph = construct_graph(json.dumps(random_sequences(n, k)), k, packed=True)
+        compacted, compact_time = _timed(compact_graph, graph)
+        _, compacted_bytes = _measured(compact_graph, graph)
+        sequence, time_full = _timed(construct_dna_sequence, graph)
+        compacted_sequence, time_compacted = _timed(construct_dna_sequence, compacted)
+        assert sequence == compacted_sequence
+
+        print(f"{graph.number_of_edges():>10} {graph.number_of_nodes():>10} {compacted.number_of_nodes():>8} "
+              f"{compact_time:12.3f} {time_full:13.3f} {time_compacted:14.3f} {compacted_bytes / 1e6:10.1f}")
+
+
+def bench_packed_file(sizes=(10_000, 100_000, 1_000_000)):
+    """ Function that compares the time to get the cleaned sequences from a
+    csv file and from its packed .npseq conversion """
+
+    print(f"{'segments':>10} {'csv [s]':>9} {'npseq load [ms]':>16} {'npseq read all [s]':>19}")
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            name = os.path.join(directory, f"DNA_{n}_21.csv")
+            random_segments(n).to_csv(name, header=False, index=False)
+            packed_name = convert_csv(name)
+
+            _, csv_time = _timed(lambda: clean_data(read_csv(name), return_sequences=True))
+            packed, load_time = _timed(load_sequences, packed_name)
+            _, read_time = _timed(lambda: sum(len(seq) for seq in packed.values()))
+            print(f"{n:>10} {csv_time:9.3f} {load_time * 1000:16.3f} {read_time:19.3f}")
+
+
+def bench_json_input(sizes=(100_000, 1_000_000, 4_000_000), k: int = 21):
+    """ Function that compares the time and peak memory of construct_graph
+    when the sequences go through generate_sequences and JSON, and when
+    the dict is passed to it directly """
+
+    print(f"{'kmers':>10} {'json [s]':>9} {'dict [s]':>9} {'json peak MB':>13} {'dict peak MB':>13}")
+    for n in sizes:
+        sequences = random_sequences(n, k)
+
+        def through_json():
+            return construct_graph(json.dumps(sequences), k, packed=True)
+
+        def direct():
+            return construct_graph(sequences, k, packed=True)
+
+        _, json_time = _timed(through_json)
+        _, dict_time = _timed(direct)
+        json_peak = _peak(through_json)
+        dict_peak = _peak(direct)
+        print(f"{n:>10} {json_time:9.3f} {dict_time:9.3f} {json_peak / 1e6:13.1f} {dict_peak / 1e6:13.1f}")
+
+
+def bench_write_sequence(sizes=(1_000_000, 4_000_000), k: int = 25):
+    """ Function that compares the peak memory of constructing the sequence
+    of a packed graph and saving it with save_output, and of streaming it
+    to the file with write_sequence """
+
+    print(f"{'length':>10} {'save_output [s]':>16} {'write_sequence [s]':>19} "
+          f"{'save_output peak MB':>20} {'write_sequence peak MB':>23}")
+    with tempfile.TemporaryDirectory() as directory:
+        name = os.path.join(directory, "sequence.txt")
+        for n in sizes:
+            graph = construct_graph(random_sequences(n, k, segment_length=n + k), k, packed=True)
+
+            def whole():
+                return save_output(construct_dna_sequence(graph), name)
+
+            def streamed():
+                return write_sequence(graph, name)
+
+            _, whole_time = _timed(whole)
+            _, streamed_time = _timed(streamed)
+            print(f"{n + k - 1:>10} {whole_time:16.3f} {streamed_time:19.3f} "
+                  f"{_peak(whole) / 1e6:20.1f} {_peak(streamed) / 1e6:23.1f}")
+
+
+def bench_incremental(n_batches: int = 10, batch_segments: int = 5_000, k: int = 21):
+    """ Function that compares the time to take in each new batch of
+    segments with IncrementalAssembler and by cleaning all the segments
+    so far and constructing their graph again """
+
+    print(f"{'batch':>6} {'segments':>9} {'incremental [s]':>16} {'rebuild [s]':>12}")
+    genome = random_genome(batch_segments * 10, seed=0)
+    assembler = IncrementalAssembler(k)
+    batches = []
+    for i in range(n_batches):
+        batch = simulate_segments(genome, 100, coverage=batch_segments * 100 / len(genome), seed=i)
+        batch["SegmentNr"] += i * len(batch)
+        batches.append(batch)
+
+        _, incremental_time = _timed(assembler.add_segments, batch)
+        _, rebuild_time = _timed(lambda: construct_graph(clean_data(pd.concat(batches), return_sequences=True)[1], k))
+        print(f"{i + 1:>6} {len(assembler.sequences):>9} {incremental_time:16.3f} {rebuild_time:12.3f}")
+
+
+def bench_read_rows(sizes=(10_000, 100_000, 1_000_000)):
+    """ Function that compares the time to get the cleaned sequences of a
+    csv file with pandas (read_csv and clean_data) and with NumPy only
+    (read_rows and clean_rows) """
+
+    print(f"{'segments':>10} {'rows':>10} {'pandas [s]':>11} {'numpy [s]':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        for n in sizes:
+            df = random_segments(n)
+            name = write_csv(df, directory, n, 21)
+
+            expected, pandas_time = _timed(lambda: clean_data(read_csv(name), return_sequences=True)[1])
+            sequences, numpy_time = _timed(lambda: clean_rows(read_rows(name)))
+            assert sequences == expected
+            print(f"{n:>10} {len(df):>10} {pandas_time:11.3f} {numpy_time:10.3f}")
+
+
+# modules whose import time bench_startup reports
+STARTUP_MODULES = ("project", "numpy", "pandas", "networkx", "matplotlib")
+
+
+def _import_times(args: list, cwd: str) -> tuple:
+    """ Helper function that runs python -X importtime with some arguments
+    in a given directory and returns the cumulative import time in ms of
+    every module and the wall time of the run in ms """
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output=True, text=True,
+                            check=True, cwd=cwd)
+    wall = (time.perf_counter() - start) * 1000
+
+    # lines of the form "import time: self [us] | cumulative | imported package"
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.strip()
+        times[name] = max(times.get(name, 0), int(cumulative) / 1000)
+    return times, wall
+
+
+def bench_startup(n_segments: int = 2_000):
+    """ Function that measures with -X importtime how long it takes to
+    import project.py and the heavy modules that it uses, on its own and
+    in the command line on a small file with and without --packed """
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "project.py")
+    with tempfile.TemporaryDirectory() as directory:
+        name = write_csv(random_segments(n_segments), directory, 1, 5)
+        runs = {
+            "import project": ["-c", "import project"],
+            "--help": [script, "--help"],
+            "csv": [script, name, "--no-cache"],
+            "csv --packed": [script, name, "--no-cache", "--packed"],
+        }
+
+        header = " ".join(f"{module + ' [ms]':>16}" for module in STARTUP_MODULES)
+        print(f"{'run':>15} {header} {'wall [ms]':>10}")
+        for label, args in runs.items():
+            # the command line saves its output files to the working directory,
+            # and runs as __main__, so project has no import time of its own
+            times, wall = _import_times(args, os.path.dirname(script) if label == "import project" else directory)
+            columns = " ".join(f"{times[module]:16.1f}" if module in times else f"{'-':>16}"
+                               for module in STARTUP_MODULES)
+            print(f"{label:>15} {columns} {wall:10.1f}")
+
+
+def bench_canonical(lengths=(100_000, 1_000_000), k: int = 31):
+    """ Function that compares the graphs of segments read from both strands
+    with and without canonical=True: its time, the number of nodes and the
+    memory of the packed graph """
+
+    print(f"{'genome':>9} {'canonical':>10} {'time [s]':>9} {'nodes':>9} {'graph [MB]':>11}")
+    for length in lengths:
+        df = simulate_segments(random_genome(length, seed=0), 200, coverage=5, seed=0, reverse=0.5)
+        sequences = clean_data(df, return_sequences=True)[1]
+        for canonical in (False, True):
+            graph, seconds = _timed(lambda: construct_graph(sequences, k, packed=True, canonical=canonical))
+            size = graph.kmers.nbytes + graph.indptr.nbytes + graph.indices.nbytes + graph.counts.nbytes
+            print(f"{length:>9} {str(canonical):>10} {seconds:9.3f} {graph.number_of_nodes():>9} {size / 1e6:11.1f}")
+
+
+async def _service_jobs(names: list, workers: int) -> None:
+    """ Helper function that sends the files to a JobService on localhost
+    and waits until all of them are assembled """
+
+    async def post(name: str) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", service.port)
+        content = json.dumps({"csv": name}).encode("ascii")
+        writer.write(f"POST /jobs HTTP/1.1\r\nContent-Length: {len(content)}\r\n\r\n".encode("ascii") + content)
+        await writer.drain()
+        # the job is queued once the service answers
+        status = await reader.readline()
+        writer.close()
+        await writer.wait_closed()
+        return status
+
+    service = JobService(workers, max_queue=len(names))
+    await service.start()
+    try:
+        statuses = await asyncio.gather(*(post(name) for name in names))
+        if not all(b" 202 " in status for status in statuses):
+            raise RuntimeError(f"The service turned jobs away: {statuses}")
+        await service._queue.join()
+    finally:
+        await service.close()
+
+
+def bench_service(n_files: int = 20, n_segments: int = 2_000, workers: int = 1):
+    """ Function that compares the time to assemble small files with one
+    run of the command line per file and with jobs sent to a JobService,
+    which starts its interpreter and imports once """
+
+    with tempfile.TemporaryDirectory() as directory:
+        names = [write_csv(random_segments(n_segments, seed=x), directory, x, 5) for x in range(1, n_files + 1)]
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "project.py")
+
+        def command_line():
+            for name in names:
+                subprocess.run([sys.executable, script, name, "--no-cache", "--packed"], cwd=directory,
+                               capture_output=True, check=True)
+
+        _, cli_time = _timed(command_line)
+        _, service_time = _timed(lambda: asyncio.run(_service_jobs(names, workers)))
+        print(f"{'files':>6} {'command line [s]':>17} {'service [s]':>12}")
+        print(f"{n_files:>6} {cli_time:17.3f} {service_time:12.3f}")
+
+
+BENCHMARKS = {
+    "clean_data": bench_clean_data,
+    "sequencer": bench_sequencer,
+    "graph_memory": bench_graph_memory,
+    "parallel_graph": bench_parallel_graph,
+    "euler_path": bench_euler_path,
+    "compaction": bench_compaction,
+    "packed_file": bench_packed_file,
+    "json_input": bench_json_input,
+    "write_sequence": bench_write_sequence,
+    "incremental": bench_incremental,
+    "read_rows": bench_read_rows,
+    "startup": bench_startup,
+    "canonical": bench_canonical,
+    "service": bench_service,
+}
+
+
+if __name__ == "__main__":
+
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"== {name}")
+        BENCHMARKS[name]()
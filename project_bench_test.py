@@ -0,0 +1,97 @@
+"""
+Benchmark suite for the assembly pipeline, on synthetic data sets from
+project_bench.simulate_segments. Needs the pytest-benchmark plugin:
+
+    python -m pytest project_bench_test.py --benchmark-only
+    python -m pytest project_bench_test.py --benchmark-only --benchmark-compare=0001 --benchmark-compare-fail=mean:20%
+
+The baseline 0001_baseline.json in .benchmarks was saved with --benchmark-save=baseline. The
+scales to run are listed in the DNA_BENCH_SCALES environment variable, small and medium by default.
+The benchmarks are skipped by a plain pytest run, unless --benchmark-only is passed or
+DNA_BENCH_SCALES is set.
+"""
+
+import os
+
+from pytest import fixture, importorskip, mark
+
+importorskip("pytest_benchmark")
+
+from project import (_construct_euler_path, clean_data, construct_contigs, construct_dna_sequence,
+                     construct_graph, is_valid_graph, read_csv)
+from project_bench import random_genome, simulate_segments, write_csv
+
+# genome length, segment length and coverage of every scale
+SCALES = {
+    "small": (5_000, 100, 10),
+    "medium": (50_000, 200, 10),
+    "large": (500_000, 500, 10),
+}
+K = 21
+
+SELECTED = os.environ.get("DNA_BENCH_SCALES", "small,medium").split(",")
+
+# the benchmarks only run when they are asked for
+pytestmark = mark.skipif("not config.getoption('benchmark_only') and 'DNA_BENCH_SCALES' not in os.environ",
+                         reason="benchmarks run with --benchmark-only or DNA_BENCH_SCALES")
+
+scales = mark.parametrize("scale", SELECTED)
+
+
+@fixture(scope="module")
+def datasets(tmp_path_factory) -> dict:
+    """ Function that writes one DNA_[x]_[k].csv file per scale, with a few
+    segments of every kind of error"""
+
+    directory = tmp_path_factory.mktemp("datasets")
+    names = {}
+    for x, scale in enumerate(SELECTED, start=1):
+        length, segment_length, coverage = SCALES[scale]
+        df = simulate_segments(random_genome(length, seed=x), segment_length, coverage, seed=x,
+                               missing=0.01, conflicts=0.01, multihot=0.01, duplicates=0.01)
+        names[scale] = write_csv(df, directory, x, K)
+    return names
+
+
+@scales
+def test_read_csv(benchmark, datasets: dict, scale: str) -> None:
+    benchmark(read_csv, datasets[scale])
+
+
+@scales
+def test_clean_data(benchmark, datasets: dict, scale: str) -> None:
+    df = read_csv(datasets[scale])
+    benchmark(clean_data, df, return_sequences=True)
+
+
+@scales
+@mark.parametrize("packed", [False, True])
+def test_construct_graph(benchmark, datasets: dict, scale: str, packed: bool) -> None:
+    _, sequences = clean_data(read_csv(datasets[scale]), return_sequences=True)
+    benchmark.pedantic(construct_graph, (sequences, K, packed), rounds=3)
+
+
+@scales
+@mark.parametrize("packed", [False, True])
+def test_euler_path(benchmark, scale: str, packed: bool) -> None:
+    # a single segment, so that the graph is Eulerian
+    length = SCALES[scale][0]
+    graph = construct_graph([random_genome(length, seed=0)], K, packed=packed)
+    path = benchmark.pedantic(_construct_euler_path, (graph,), rounds=3)
+    assert len(path) == length - K + 2
+
+
+def _assemble(name: str) -> str:
+    """ Helper function that runs the whole pipeline of the command line on
+    a file, without the cache and the output files"""
+    _, sequences = clean_data(read_csv(name), return_sequences=True)
+    graph = construct_graph(sequences, K)
+    sequence = construct_dna_sequence(graph)
+    if not is_valid_graph(graph):
+        construct_contigs(graph)
+    return sequence
+
+
+@scales
+def test_end_to_end(benchmark, datasets: dict, scale: str) -> None:
+    benchmark.pedantic(_assemble, (datasets[scale],), rounds=3)
@@ -1,10 +1,55 @@
 from project import clean_data, generate_sequences, construct_graph, is_valid_graph, construct_dna_sequence
+from project import _find_kmers, _iter_kmers, _pack_kmers, _unpack_kmer
+from project import _sequencer, _graph_from_sequences, iter_sequences, read_csv, read_rows, clean_rows
+from project import save_sequences, load_sequences, convert_csv
+from project import _check_graph, GraphCheck, construct_contigs, save_contigs, Contig, compact_graph
+from project import sweep_k, best_k, SweepResult
+from project import cache_key, load_cached, save_cached
+from project import plot_graph, export_graph, _plot_view
+from project import assemble_batch, save_report, FileReport
+from project import profile, _construct_euler_path, write_sequence, save_output, _euler_walk, _print_path
+from project_bench import random_genome, simulate_segments
+from project import IncrementalAssembler
+from project import orient_sequences, _canonical_codes, _encode, _reverse_complement
+from project import JobService
 
-from pytest import mark
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pytest import importorskip, mark, raises
+import gzip
+import json
+from collections import Counter
+import numpy as np
 import pandas as pd
 import networkx as nx
 
 
+def _run_project(directory, *args) -> subprocess.CompletedProcess:
+    """ Helper function that runs the command line of project.py in a directory"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "project.py")
+    return subprocess.run([sys.executable, script, *args], cwd=directory, capture_output=True, text=True)
+
+
+def _random_segments(n_segments: int, seed: int = 0) -> pd.DataFrame:
+    """ Helper function that creates shuffled segments of 2 to 5 positions
+    with some duplicate rows, duplicate sequences and multi-hot rows"""
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(2, 6, n_segments)
+    segments = np.repeat(np.arange(1, n_segments + 1), lengths)
+    positions = np.concatenate([np.arange(1, n + 1) for n in lengths])
+    onehot = np.eye(4, dtype=np.int64)[rng.integers(0, 4, len(segments))]
+    onehot[rng.choice(len(segments), n_segments // 10)] = 1
+    df = pd.DataFrame(np.column_stack([segments, positions, onehot]),
+                      columns=['SegmentNr', 'Position', 'A', 'C', 'G', 'T'])
+    df = pd.concat([df, df.sample(n_segments // 10, random_state=seed)])
+    return df.sample(frac=1, random_state=seed)
+
+
 @mark.parametrize(
     'dna_df, expected',
     [
@@ -85,6 +130,23 @@ import networkx as nx
                     columns=['SegmentNr', 'Position', 'A', 'C', 'G', 'T']
                     ),
         ),
+        (       # unsorted segments, one with a missing position and one
+                # with a conflicting duplicate
+                pd.DataFrame(data=[
+                    [3, 2, 0, 0, 1, 0],
+                    [7, 1, 1, 0, 0, 0],
+                    [3, 1, 0, 1, 0, 0],
+                    [9, 1, 0, 0, 0, 1],
+                    [7, 3, 0, 1, 0, 0],
+                    [9, 2, 1, 0, 0, 0],
+                    [9, 2, 0, 1, 0, 0]],
+                    columns=['SegmentNr', 'Position', 'A', 'C', 'G', 'T']),
+                pd.DataFrame(data=[
+                    [3, 1, 0, 1, 0, 0],
+                    [3, 2, 0, 0, 1, 0]],
+                    columns=['SegmentNr', 'Position', 'A', 'C', 'G', 'T']
+                    ),
+        ),
 
     ],
 
@@ -93,6 +155,32 @@ def test_clean_data(dna_df: pd.DataFrame, expected: pd.DataFrame) -> None:
     assert clean_data(dna_df).equals(expected)
 
 
+@mark.parametrize('seed', [0, 1, 2])
+def test_clean_data_sequences(seed: int) -> None:
+    df = _random_segments(400, seed)
+    cleaned, sequences = clean_data(df, return_sequences=True)
+    assert cleaned.equals(clean_data(df))
+    assert sequences == _sequencer(cleaned)
+    assert len(set(sequences.values())) == len(sequences)
+    assert generate_sequences(cleaned, sequences) == generate_sequences(cleaned)
+
+
+@mark.parametrize('seed', [0, 1, 2])
+def test_clean_rows(tmp_path, seed: int) -> None:
+    name = tmp_path / "DNA_1_3.csv"
+    _random_segments(400, seed).to_csv(name, header=False, index=False)
+    rows = read_rows(name)
+    assert (rows == read_csv(name).to_numpy()).all()
+    assert clean_rows(rows) == clean_data(read_csv(name), return_sequences=True)[1]
+
+
+def test_clean_rows_empty(tmp_path) -> None:
+    name = tmp_path / "DNA_1_3.csv"
+    name.write_text("")
+    assert read_rows(name).shape == (0, 6)
+    assert clean_rows(read_rows(name)) == {}
+
+
 @mark.parametrize(
     'dna_df, expected_json_str',
     [ ( 
@@ -126,6 +214,18 @@ def test_clean_data(dna_df: pd.DataFrame, expected: pd.DataFrame) -> None:
                     columns=['SegmentNr', 'Position', 'A', 'C', 'G', 'T']
                 ),
                 '{"1": "ATAC", "4": "CCGA", "6": "TGATAG"}'
+    ),
+            # test case 3 with interleaved segments and a row without a hit
+    (pd.DataFrame(data=[
+                    [3, 1, 0, 0, 1, 0],
+                    [2, 1, 0, 0, 0, 1],
+                    [3, 2, 1, 0, 0, 0],
+                    [2, 2, 0, 0, 0, 0],
+                    [2, 3, 0, 1, 0, 0],
+                    ],
+                    columns=['SegmentNr', 'Position', 'A', 'C', 'G', 'T']
+                ),
+                '{"3": "GA", "2": "TC"}'
     ),
         (
     pd.DataFrame(columns=['SegmentNr', 'Position', 'A', 'C', 'G', 'T']),
@@ -139,6 +239,109 @@ def test_generate_sequences(dna_df: pd.DataFrame, expected_json_str: str) -> Non
     assert (generate_sequences(dna_df) == expected_json_str)
 
 
+@mark.parametrize(
+    'presorted, chunksize',
+    [(True, 1_000_000), (True, 7), (False, 1_000_000), (False, 50)])
+def test_iter_sequences(tmp_path, presorted: bool, chunksize: int) -> None:
+    df = _random_segments(500)
+    if presorted:
+        df = df.sort_values('SegmentNr', kind='stable')
+    name = tmp_path / 'DNA_1_3.csv'
+    df.to_csv(name, header=False, index=False)
+
+    expected = _sequencer(clean_data(read_csv(name)))
+    assert dict(iter_sequences(name, chunksize, presorted)) == expected
+
+    G = _graph_from_sequences((seq for _, seq in iter_sequences(name, chunksize, presorted)), 3)
+    assert sorted(G.edges()) == sorted(construct_graph(generate_sequences(clean_data(df)), 3).edges())
+
+
+def test_iter_sequences_unsorted(tmp_path) -> None:
+    name = tmp_path / 'DNA_1_3.csv'
+    _random_segments(50).to_csv(name, header=False, index=False)
+    with raises(ValueError):
+        list(iter_sequences(name))
+
+
+@mark.parametrize(
+    'sequences',
+    [
+        {1: "ATAC", 4: "CCGA", 6: "TGATAG"},
+        {9: "A", 2: "", 3: "GGT"},
+        {},
+    ])
+def test_save_sequences(tmp_path, sequences: dict) -> None:
+    name = tmp_path / "DNA_1_3.npseq"
+    save_sequences(sequences, name)
+    packed = load_sequences(name)
+
+    assert dict(packed) == sequences
+    assert list(packed) == sorted(sequences)
+    assert list(packed.values()) == [sequences[seg] for seg in sorted(sequences)]
+    assert 5 not in packed
+    if sequences:
+        assert isinstance(packed.bases, np.memmap)
+
+
+def test_convert_csv(tmp_path) -> None:
+    df = _random_segments(300)
+    name = tmp_path / 'DNA_1_3.csv'
+    df.to_csv(name, header=False, index=False)
+
+    packed = load_sequences(convert_csv(str(name)))
+    assert (tmp_path / 'DNA_1_3.npseq').exists()
+    assert dict(packed) == clean_data(df, return_sequences=True)[1]
+    assert sorted(_graph_from_sequences(packed.values(), 4).edges()) == \
+        sorted(construct_graph(generate_sequences(clean_data(df)), 4).edges())
+
+
+@mark.parametrize(
+    'sequence, k, expected_kmers',
+    [
+        ("CCTGAACC", 3, ["CCT", "CTG", "TGA", "GAA", "AAC", "ACC"]),
+        ("AACCC", 7, []),
+        ("ACGT", 4, ["ACGT"]),
+    ])
+def test_find_kmers(sequence: str, k: int, expected_kmers: list) -> None:
+    assert _find_kmers(sequence, k) == expected_kmers
+    assert [bytes(kmer).decode() for kmer in _iter_kmers(sequence.encode(), k)] == expected_kmers
+    assert [_unpack_kmer(kmer, k) for kmer in _pack_kmers(sequence, k)] == expected_kmers
+
+
+def test_find_kmers_100kb() -> None:
+    sequence = random_genome(100_000)
+    kmers = _find_kmers(sequence, 31)
+    assert len(kmers) == 100_000 - 30
+    assert kmers[-1] == sequence[-31:]
+
+
+@mark.parametrize('k', [1, 21, 32])
+def test_pack_kmers_10mb(k: int) -> None:
+    sequence = random_genome(10_000_000, seed=k)
+    packed = _pack_kmers(sequence, k)
+    assert packed.dtype == np.uint64
+    assert len(packed) == 10_000_000 - k + 1
+    for i in (0, 4_999_999, len(packed) - 1):
+        assert _unpack_kmer(packed[i], k) == sequence[i:i + k]
+
+
+def test_iter_kmers_10mb() -> None:
+    data = random_genome(10_000_000).encode()
+    count = 0
+    for kmer in _iter_kmers(data, 25):
+        count += 1
+    assert count == 10_000_000 - 24
+    assert isinstance(kmer, memoryview) and kmer.obj is data
+    assert bytes(kmer) == data[-25:]
+
+
+def test_pack_kmers_invalid() -> None:
+    with raises(ValueError):
+        _pack_kmers("ACGN", 2)
+    with raises(ValueError):
+        _pack_kmers("ACGT", 33)
+
+
 @mark.parametrize(
     'json_data, k,  expected_edge_list',
     [
@@ -177,10 +380,51 @@ def test_generate_sequences(dna_df: pd.DataFrame, expected_json_str: str) -> Non
             ],
         ),
     ])
-def test_construct_graph(json_data: str, k: int, expected_edge_list: list) -> None:
-    G = construct_graph(json_data, k)
+@mark.parametrize('packed', [False, True])
+def test_construct_graph(json_data: str, k: int, expected_edge_list: list, packed: bool) -> None:
+    G = construct_graph(json_data, k, packed=packed)
     assert sorted(G.edges()) == sorted(expected_edge_list)
 
+
+@mark.parametrize('packed', [False, True])
+@mark.parametrize('workers', [1, 2])
+def test_construct_graph_inputs(monkeypatch, tmp_path, packed: bool, workers: int) -> None:
+    monkeypatch.setattr('project._PARALLEL_MIN_BASES', 0)
+    sequences = clean_data(_random_segments(300), return_sequences=True)[1]
+    save_sequences(sequences, tmp_path / "sequences.npseq")
+    expected = sorted(construct_graph(generate_sequences(None, sequences), 3, packed=packed).edges())
+    for data in (sequences, iter(sequences.values()), list(sequences.values()),
+                 load_sequences(tmp_path / "sequences.npseq")):
+        assert sorted(construct_graph(data, 3, packed=packed, workers=workers).edges()) == expected
+
+
+@mark.parametrize('packed', [False, True])
+def test_construct_graph_workers(monkeypatch, packed: bool) -> None:
+    monkeypatch.setattr('project._PARALLEL_MIN_BASES', 0)
+    json_data = generate_sequences(clean_data(_random_segments(300)))
+    serial = construct_graph(json_data, 3, packed=packed)
+    parallel = construct_graph(json_data, 3, packed=packed, workers=3)
+    assert sorted(parallel.edges()) == sorted(serial.edges())
+    assert list(parallel.nodes()) == list(serial.nodes())
+
+
+@mark.parametrize(
+    'json_data, k, expected_sequence',
+    [
+        ('{"1":"TTAATT","2":"ATTACT"}', 4, "TTAATTACT"),
+        ('{"1":"ACGTTGCA"}', 3, "ACGTTGCA"),
+        ('{"1":"AAAC","2":"GGTT"}', 3, ""),
+        ('{"2":"AACCC"}', 7, ""),
+        # circular inputs, which start at the first kmer and not the smallest
+        ('{"1":"CACGTCA"}', 3, "CACGTC"),
+        ('{"1":"TTGTG","2":"GG"}', 2, "TTGTGG"),
+    ])
+def test_construct_dna_sequence_packed(json_data: str, k: int, expected_sequence: str) -> None:
+    G = construct_graph(json_data, k, packed=True)
+    assert construct_dna_sequence(G) == construct_dna_sequence(construct_graph(json_data, k))
+    assert construct_dna_sequence(G) == expected_sequence
+
+
 @mark.parametrize(
     'DNA_edge_list,  expected_validity',
     [
@@ -213,6 +457,54 @@ def test_is_valid_graph(DNA_edge_list: list, expected_validity: bool) -> None:
     assert is_valid_graph(debruijn_graph) is expected_validity
 
 
+@mark.parametrize(
+    'DNA_edge_list, expected_check',
+    [
+        (
+                [('GG', 'GA'), ('GA', 'AT'), ('AT', 'TG'), ('TG', 'GA')],
+                GraphCheck(True, 'GG', {'GG': 1, 'GA': -1})
+        ),
+        (       # a cycle and a separate path are not weakly connected
+                [('AC', 'CA'), ('CA', 'AC'), ('GT', 'TT')],
+                GraphCheck(False, None, {'GT': 1, 'TT': -1})
+        ),
+        (
+                [],
+                GraphCheck(True, None, {})
+        ),
+    ])
+def test_check_graph(DNA_edge_list: list, expected_check: GraphCheck) -> None:
+    debruijn_graph = nx.MultiDiGraph()
+    debruijn_graph.add_edges_from(DNA_edge_list)
+
+    assert _check_graph(debruijn_graph) == expected_check
+    debruijn_graph.add_edge('GG', 'CC')
+    assert _check_graph(debruijn_graph).imbalance != expected_check.imbalance
+
+
+def test_check_graph_isolated_vertex() -> None:
+    # a vertex without edges is a unitig of a compacted graph, which the path has to visit
+    debruijn_graph = nx.MultiDiGraph()
+    debruijn_graph.add_node('GGTT')
+    assert _check_graph(debruijn_graph) == GraphCheck(True, 'GGTT', {})
+    debruijn_graph.add_edges_from([('AC', 'CG'), ('CG', 'GA'), ('GA', 'AC')])
+    assert _check_graph(debruijn_graph) == GraphCheck(False, None, {})
+
+
+def test_check_graph_after_change() -> None:
+    # the edge is moved, so the number of nodes and edges stays the same
+    G = nx.MultiDiGraph()
+    G.add_edges_from([('AC', 'CG'), ('CG', 'GT'), ('GT', 'TA')])
+    assert construct_dna_sequence(G) == 'ACGTA'
+    G.remove_edge('GT', 'TA')
+    G.add_edge('CG', 'TA')
+    assert not is_valid_graph(G)
+    assert construct_dna_sequence(G) == ''
+
+    packed = construct_graph(['ACGTA'], 3, packed=True)
+    assert _check_graph(packed) is _check_graph(packed)
+
+
 @mark.parametrize(
     'DNA_edge_list,  possible_dna_sequence',
     [       # test case 1
@@ -228,10 +520,567 @@ def test_is_valid_graph(DNA_edge_list: list, expected_validity: bool) -> None:
                 [('AA','TT'), ('TT','GG'), ('GG', 'CA'), ('CA', 'AA')],
                 ['AATGA']
         ),
+        (   # test case 4 with parallel edges from a repeated kmer
+                [('GA','AT'), ('AT','TA'), ('TA','AT'), ('AT','TA'), ('TA','AC')],
+                ['GATATAC']
+        ),
     ])
 def test_construct_dna_sequence(DNA_edge_list: list, possible_dna_sequence) -> None:
     debruijn_graph = nx.MultiDiGraph()
     for edge in DNA_edge_list:
         debruijn_graph.add_edge(edge[0], edge[1])
 
-    assert construct_dna_sequence(debruijn_graph) in possible_dna_sequence
\ No newline at end of file
+    assert construct_dna_sequence(debruijn_graph) in possible_dna_sequence
+
+
+@mark.parametrize(
+    'json_data, k, expected_contigs',
+    [
+        (   # a branch after AC, the kmer AAC occurs twice
+            '{"1":"AACGT","2":"AACTT"}',
+            3,
+            [Contig("AAC", 3, 2.0), Contig("ACGT", 4, 1.0), Contig("ACTT", 4, 1.0)],
+        ),
+        (   # an isolated cycle and a separate path
+            '{"1":"ACGAC","2":"TTGG"}',
+            3,
+            [Contig("TTGG", 4, 1.0), Contig("ACGAC", 5, 1.0)],
+        ),
+        (
+            '{"1":"AC"}',
+            3,
+            [],
+        ),
+    ])
+@mark.parametrize('packed', [False, True])
+def test_construct_contigs(json_data: str, k: int, expected_contigs: list, packed: bool) -> None:
+    G = construct_graph(json_data, k, packed=packed)
+    assert sorted(construct_contigs(G)) == sorted(expected_contigs)
+
+
+def test_save_contigs(tmp_path) -> None:
+    name = tmp_path / "contigs.fasta"
+    save_contigs([Contig("ACGTACG", 7, 2.0), Contig("TT", 2, 1.5)], name, width=3)
+    assert name.read_text() == (">contig_1 length=7 coverage=2.00\nACG\nTAC\nG\n"
+                                ">contig_2 length=2 coverage=1.50\nTT\n")
+
+
+@mark.parametrize(
+    'json_data, k, expected_nodes',
+    [
+        ('{"1":"TTAATT","2":"ATTACT"}', 4, 3),
+        ('{"1":"ACGTTGCA"}', 3, 1),
+        ('{"1":"CCTGAACC"}', 3, 1),
+        ('{"1":"GATATAC"}', 3, 4),
+        ('{"1":"AAAC","2":"GGTT"}', 3, 3),
+        ('{"1":"AACGT","2":"AACTT"}', 3, 4),
+    ])
+@mark.parametrize('packed', [False, True])
+def test_compact_graph(json_data: str, k: int, expected_nodes: int, packed: bool) -> None:
+    G = construct_graph(json_data, k, packed=packed)
+    compacted = compact_graph(G)
+    assert compacted.number_of_nodes() == expected_nodes
+    assert is_valid_graph(compacted) == is_valid_graph(G)
+    assert construct_dna_sequence(compacted) == construct_dna_sequence(G)
+
+
+@mark.parametrize('workers', [1, 2])
+def test_sweep_k(workers: int) -> None:
+    sequences = {1: random_genome(300, 1), 2: "TTAATT", 3: "ATTACT", 4: "AC"}
+    results = sweep_k(sequences.values(), range(2, 8), workers=workers)
+    assert [result.k for result in results] == list(range(2, 8))
+    for result in results:
+        G = construct_graph(json.dumps(sequences), result.k, packed=True)
+        assert result == SweepResult(result.k, is_valid_graph(G), G.number_of_nodes(),
+                                     G.number_of_edges(), len(construct_contigs(G)))
+
+
+def test_sweep_k_range() -> None:
+    with raises(ValueError):
+        sweep_k(["ACGTTGCA"], [31, 33])
+    with raises(ValueError):
+        sweep_k(["ACGTTGCA"], [1, 2])
+
+
+@mark.parametrize('packed', [False, True])
+def test_cli_sweep(tmp_path, packed: bool) -> None:
+    genome = random_genome(300, 5)
+    pd.DataFrame([[1, i + 1, *(int(base == c) for c in "ACGT")] for i, base in enumerate(genome)]
+                 ).to_csv(tmp_path / "DNA_1_21.csv", header=False, index=False)
+    options = ["--packed"] if packed else []
+    result = _run_project(tmp_path, "DNA_1_21.csv", "--no-cache", "--sweep", "25:33", *options)
+    assert result.returncode == 2 and "--sweep needs" in result.stderr
+    result = _run_project(tmp_path, "DNA_1_21.csv", "--no-cache", "--sweep", "19:23", *options)
+    assert result.returncode == 0, result.stderr
+    assert "Assembling with k = 23" in result.stdout
+    assert (tmp_path / "DNA_1.txt").read_text() == genome
+
+
+@mark.parametrize('packed', [False, True])
+def test_cli_profile(tmp_path, packed: bool) -> None:
+    genome = random_genome(300, 6)
+    pd.DataFrame([[1, i + 1, *(int(base == c) for c in "ACGT")] for i, base in enumerate(genome)]
+                 ).to_csv(tmp_path / "DNA_1_21.csv", header=False, index=False)
+    options = ["--packed"] if packed else []
+    result = _run_project(tmp_path, "DNA_1_21.csv", "--no-cache", "--profile", "profile.json", *options)
+    assert result.returncode == 0, result.stderr
+    stages = [stage for stage in json.loads((tmp_path / "profile.json").read_text())["stages"]
+              if stage["stage"] == "euler_path"]
+    # the walk that prints the path and writes the sequence is recorded once
+    assert [stage["path_length"] for stage in stages] == [len(genome) - 21 + 2]
+    assert (tmp_path / "DNA_1.txt").read_text() == genome
+
+
+def test_cli_convert_profile(tmp_path) -> None:
+    _random_segments(30, 7).to_csv(tmp_path / "DNA_1_3.csv", header=False, index=False)
+    result = _run_project(tmp_path, "DNA_1_3.csv", "--convert", "--profile", "profile.json")
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "DNA_1_3.npseq").exists()
+    stages = json.loads((tmp_path / "profile.json").read_text())["stages"]
+    assert "clean_data" in [stage["stage"] for stage in stages]
+
+
+def test_best_k() -> None:
+    assert best_k([SweepResult(3, True, 4, 5, 1), SweepResult(4, True, 4, 4, 1),
+                   SweepResult(5, False, 4, 3, 2)]).k == 4
+    assert best_k([SweepResult(3, False, 4, 5, 2), SweepResult(4, False, 4, 4, 3),
+                   SweepResult(5, False, 4, 3, 2)]).k == 5
+
+
+@mark.parametrize('packed', [False, True])
+def test_cache(tmp_path, packed: bool) -> None:
+    sequences = {1: "TTAATT", 2: "ATTACT", 3: random_genome(100, 2)}
+    G = construct_graph(json.dumps(sequences), 4, packed=packed)
+    name = tmp_path / "DNA_1_4.csv"
+    name.write_text("1,1,1,0,0,0\n")
+    key = cache_key(name, 4)
+    assert key != cache_key(name, 5)
+
+    assert load_cached(key, tmp_path / "cache") is None
+    save_cached(key, G, sequences, tmp_path / "cache")
+    cached_sequences, cached_graph = load_cached(key, tmp_path / "cache")
+    assert dict(cached_sequences) == sequences
+    assert type(cached_graph) is type(G)
+    assert sorted(cached_graph.edges()) == sorted(G.edges())
+    assert construct_dna_sequence(cached_graph) == construct_dna_sequence(G)
+
+
+def test_cache_eviction(tmp_path) -> None:
+    G = construct_graph('{"1":"ACGTTGCA"}', 3)
+    save_cached("old", G, directory=tmp_path)
+    os.utime(tmp_path / "old", (0, 0))
+    save_cached("new", G, directory=tmp_path)
+    assert load_cached("old", tmp_path) is not None
+    save_cached("newest", G, directory=tmp_path, max_bytes=2 * sum(
+        f.stat().st_size for f in (tmp_path / "new").iterdir()))
+    assert load_cached("newest", tmp_path) is not None
+    assert load_cached("new", tmp_path) is None
+    assert sorted(os.listdir(tmp_path)) == ["newest", "old"]
+
+
+def test_import_without_matplotlib() -> None:
+    code = "import sys, project; assert 'matplotlib' not in sys.modules"
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(__file__))
+
+
+def test_packed_pipeline_without_pandas(tmp_path) -> None:
+    sequence = random_genome(200, 4)
+    name = tmp_path / "DNA_1_15.csv"
+    pd.DataFrame([[1, i + 1, *(int(base == c) for c in "ACGT")] for i, base in enumerate(sequence)]
+                 ).to_csv(name, header=False, index=False)
+    code = ("import sys, project; "
+            "graph = project.construct_graph(project.clean_rows(project.read_rows(sys.argv[1])), 15, packed=True); "
+            "assert project.construct_dna_sequence(graph) == sys.argv[2]; "
+            "assert not {'pandas', 'networkx', 'matplotlib'} & set(sys.modules)")
+    subprocess.run([sys.executable, "-c", code, str(name), sequence], check=True, cwd=os.path.dirname(__file__))
+
+
+@mark.parametrize('packed', [False, True])
+def test_plot_view(packed: bool) -> None:
+    G = construct_graph(json.dumps({1: random_genome(2000, 3)}), 5, packed=packed)
+    assert _plot_view(G, 10).number_of_nodes() == 10
+    assert nx.is_weakly_connected(_plot_view(G, 10))
+    assert _plot_view(G, 2000).number_of_nodes() <= 2000
+    assert isinstance(_plot_view(G, 2000), nx.MultiDiGraph)
+
+
+def test_plot_graph(tmp_path) -> None:
+    importorskip("matplotlib")
+    G = construct_graph(json.dumps({1: random_genome(2000, 3)}), 5, packed=True)
+    plot_graph(G, tmp_path / "graph.png", max_nodes=50)
+    assert (tmp_path / "graph.png").stat().st_size > 0
+
+
+@mark.parametrize('packed', [False, True])
+def test_export_graph(tmp_path, packed: bool) -> None:
+    G = construct_graph('{"1":"GATATAC"}', 3, packed=packed)
+    export_graph(G, tmp_path / "graph.gfa")
+    lines = (tmp_path / "graph.gfa").read_text().splitlines()
+    segments = {line.split("\t")[1]: line.split("\t")[2] for line in lines if line[0] == "S"}
+    links = sorted((segments[line.split("\t")[1]], segments[line.split("\t")[3]], line.split("\t")[5:])
+                   for line in lines if line[0] == "L")
+    assert lines[0] == "H\tVN:Z:1.0"
+    assert sorted(segments.values()) == ["AC", "AT", "GA", "TA"]
+    assert links == [("AT", "TA", ["1M", "RC:i:2"]), ("GA", "AT", ["1M", "RC:i:1"]),
+                     ("TA", "AC", ["1M", "RC:i:1"]), ("TA", "AT", ["1M", "RC:i:1"])]
+
+    export_graph(G, tmp_path / "graph.graphml")
+    H = nx.read_graphml(tmp_path / "graph.graphml", force_multigraph=True)
+    assert sorted(H.edges()) == sorted(construct_graph('{"1":"GATATAC"}', 3).edges())
+    with raises(ValueError):
+        export_graph(G, tmp_path / "graph.png")
+
+
+@mark.parametrize('jobs', [1, 2])
+def test_assemble_batch(tmp_path, jobs: int) -> None:
+    _random_segments(20, 1).to_csv(tmp_path / "DNA_1_3.csv", header=False, index=False)
+    _random_segments(20, 2).to_csv(tmp_path / "DNA_2_4.csv", header=False, index=False)
+    (tmp_path / "DNA_3_x.csv").write_text("1,1,1,0,0,0\n")
+    (tmp_path / "out").mkdir()
+
+    reports = assemble_batch(str(tmp_path), jobs=jobs, output_dir=tmp_path / "out", cache=False)
+    assert [os.path.basename(report.file) for report in reports] == ["DNA_1_3.csv", "DNA_2_4.csv", "DNA_3_x.csv"]
+    for report, k in zip(reports[:2], (3, 4)):
+        df, sequences = clean_data(read_csv(report.file), return_sequences=True)
+        G = construct_graph(generate_sequences(df, sequences), k)
+        assert report.error == ""
+        assert report.length == len(construct_dna_sequence(G))
+        assert report.valid == is_valid_graph(G)
+        assert report.peak_memory > 0
+    assert reports[2].error.startswith("ValueError")
+    assert (tmp_path / "out" / "DNA_1.txt").exists() or reports[0].length == 0
+
+    save_report(reports, tmp_path / "report.csv")
+    assert list(pd.read_csv(tmp_path / "report.csv").columns) == list(FileReport._fields)
+
+
+def test_profile(tmp_path) -> None:
+    _random_segments(30, 4).to_csv(tmp_path / "DNA_1_3.csv", header=False, index=False)
+    with profile() as recorded:
+        df = read_csv(tmp_path / "DNA_1_3.csv")
+        df_cleaned, sequences = clean_data(df, return_sequences=True)
+        G = construct_graph(generate_sequences(df_cleaned, sequences), 3)
+        path = _construct_euler_path(G)
+    # nothing is recorded outside of the block
+    is_valid_graph(G)
+
+    stages = {stage["stage"]: stage for stage in recorded.stages}
+    assert [stage["stage"] for stage in recorded.stages] == [
+        "read_csv", "clean_data", "generate_sequences",
+        "construct_graph", "graph_from_sequences", "euler_path"]
+    assert stages["read_csv"]["rows"] == len(df)
+    assert stages["clean_data"]["rows_in"] == len(df)
+    assert stages["clean_data"]["segments_kept"] == len(sequences)
+    assert stages["graph_from_sequences"]["depth"] == 1
+    assert stages["construct_graph"]["kmers"] == G.number_of_edges()
+    assert stages["construct_graph"]["nodes"] == G.number_of_nodes()
+    assert stages["euler_path"]["path_length"] == len(path)
+    assert all(stage["seconds"] >= 0 and stage["peak_memory"] >= 0 for stage in recorded.stages)
+    assert stages["construct_graph"]["peak_memory"] >= stages["graph_from_sequences"]["peak_memory"]
+    assert json.loads(recorded.to_json())["stages"][0]["stage"] == "read_csv"
+
+
+@mark.parametrize('errors, kept', [
+    ({}, 1.0),
+    ({'duplicates': 0.2}, 1.0),
+    ({'missing': 0.1, 'conflicts': 0.1, 'multihot': 0.1}, 0.7),
+])
+def test_simulate_segments(errors: dict, kept: float) -> None:
+    genome = random_genome(2000, 5)
+    df = simulate_segments(genome, 50, 5, seed=5, **errors)
+    assert list(df.columns) == ['SegmentNr', 'Position', 'A', 'C', 'G', 'T']
+    assert df.equals(simulate_segments(genome, 50, 5, seed=5, **errors))
+
+    _, sequences = clean_data(df, return_sequences=True)
+    clean = set(clean_data(simulate_segments(genome, 50, 5, seed=5), return_sequences=True)[1].values())
+    assert all(len(seq) == 50 and seq in genome for seq in sequences.values())
+    assert set(sequences.values()) <= clean
+    assert len(sequences) >= kept * len(clean) - 2
+
+
+@mark.parametrize('packed', [False, True])
+@mark.parametrize('workers', [1, 2])
+def test_construct_graph_min_count(monkeypatch, packed: bool, workers: int) -> None:
+    monkeypatch.setattr('project._PARALLEL_MIN_BASES', 0)
+    genome = random_genome(300, 6)
+    noisy = genome[:150] + ("A" if genome[150] != "A" else "C") + genome[151:]
+    sequences = {1: genome, 2: genome, 3: noisy}
+
+    G = construct_graph(sequences, 11, packed=packed, workers=workers, min_count=2)
+    assert G.number_of_nodes() == len(genome) - 9
+    assert [contig.sequence for contig in construct_contigs(G)] == [genome]
+    assert len(construct_contigs(construct_graph(sequences, 11, packed=packed, workers=workers))) > 1
+
+    multiplicity = Counter(construct_graph(sequences, 11, packed=packed).edges())
+    assert sorted(G.edges()) == sorted(edge for edge in multiplicity.elements() if multiplicity[edge] >= 2)
+    assert sweep_k(sequences.values(), [11], min_count=2)[0].contigs == 1
+
+
+@mark.parametrize('k', [4, 5, 21])
+def test_canonical_codes(k: int) -> None:
+    sequence = random_genome(300, k)
+    canonical, strand = _canonical_codes(_encode(sequence), k)
+    rc_canonical, rc_strand = _canonical_codes(_encode(_reverse_complement(sequence)), k)
+    assert (canonical == rc_canonical[::-1]).all()
+    assert (strand == -rc_strand[::-1]).all()
+    assert (canonical == np.minimum(_pack_kmers(sequence, k), _pack_kmers(_reverse_complement(sequence), k)[::-1])).all()
+    assert _canonical_codes(_encode("ACGT"), 4)[1].tolist() == [0]
+
+
+@mark.parametrize('k', [15, 21, 40])
+@mark.parametrize('packed', [False, True])
+def test_orient_sequences(k: int, packed: bool) -> None:
+    # segments that overlap by k - 1 nucleotides, half of them read from the other strand
+    step = 100 - k + 1
+    genome = random_genome(30 * step + k - 1, seed=k)
+    segments = [genome[i:i + 100] for i in range(0, len(genome) - 99, step)]
+    flipped = np.random.default_rng(k).random(len(segments)) < 0.5
+    mixed = [_reverse_complement(seq) if flip else seq for seq, flip in zip(segments, flipped)]
+
+    oriented = orient_sequences(mixed, k)
+    assert oriented in (segments, [_reverse_complement(seq) for seq in segments])
+    assert oriented[0] == mixed[0]
+    assert orient_sequences(segments, k) == segments
+    # the profile counts the reversed segments of a generator as well
+    with profile(memory=False) as recorded:
+        oriented = orient_sequences(iter(mixed), k)
+    reversed_count = sum(a != b for a, b in zip(mixed, oriented))
+    assert reversed_count > 0
+    assert recorded.stages[0]["reversed"] == reversed_count
+
+    if packed and k > 32:
+        return
+    assert not is_valid_graph(construct_graph(mixed, k, packed=packed))
+    G = construct_graph(dict(enumerate(mixed)), k, packed=packed, canonical=True)
+    assert is_valid_graph(G)
+    assert construct_dna_sequence(G) in (genome, _reverse_complement(genome))
+
+
+@mark.parametrize('json_data, k', [
+    ('{"1":"ATTAGACCTG","2":"CTGCCGGAA","3":"GAAGG"}', 3),
+    ('{"1":"GATATAC"}', 3),
+    ('{"1":"AAAC","2":"GGTT"}', 3),
+])
+@mark.parametrize('graph_type', ['networkx', 'packed', 'compacted'])
+@mark.parametrize('buffer_size', [1, 4, 1 << 20])
+def test_write_sequence(tmp_path, json_data: str, k: int, graph_type: str, buffer_size: int) -> None:
+    G = construct_graph(json_data, k, packed=graph_type == 'packed')
+    G = compact_graph(G) if graph_type == 'compacted' else G
+    sequence = construct_dna_sequence(G)
+    save_output(sequence, tmp_path / "expected.txt")
+
+    length = write_sequence(G, str(tmp_path / "sequence.txt"), buffer_size=buffer_size)
+    assert length == len(sequence)
+    if sequence == '':
+        assert not (tmp_path / "sequence.txt").exists()
+        return
+    assert (tmp_path / "sequence.txt").read_bytes() == (tmp_path / "expected.txt").read_bytes()
+
+    write_sequence(G, str(tmp_path / "sequence.fasta.gz"), fasta=True, width=4, name="DNA_1",
+                   buffer_size=buffer_size, batch=2, walk=_euler_walk(G))
+    with gzip.open(tmp_path / "sequence.fasta.gz", "rt") as f:
+        lines = f.read().splitlines()
+    assert lines[0] == ">DNA_1"
+    assert "".join(lines[1:]) == sequence
+    assert all(len(line) == 4 for line in lines[1:-1]) and 0 < len(lines[-1]) <= 4
+
+
+@mark.parametrize('packed', [False, True])
+@mark.parametrize('batch', [1, 2, 1 << 16])
+def test_print_path(capsys, packed: bool, batch: int) -> None:
+    G = construct_graph('{"1":"ATTAGACCTG","2":"CTGCCGGAA","3":"GAAGG"}', 4, packed=packed)
+    _print_path(G, _euler_walk(G), batch)
+    assert capsys.readouterr().out == " - ".join(_construct_euler_path(G)) + "\n"
+
+
+def test_incremental_assembler() -> None:
+    batches = [_random_segments(200, seed) for seed in (7, 8, 9)]
+    for i, batch in enumerate(batches):
+        batch["SegmentNr"] += 1000 * i
+
+    assembler = IncrementalAssembler(3)
+    for i in range(len(batches)):
+        assembler.add_segments(batches[i])
+        _, sequences = clean_data(pd.concat(batches[:i + 1]), return_sequences=True)
+        G = construct_graph(sequences, 3)
+        assert sorted(assembler.graph.edges()) == sorted(G.edges())
+        check = assembler.check()
+        assert (check.valid, check.imbalance) == (_check_graph(G).valid, _check_graph(G).imbalance)
+
+    # retract a third of the segments, the copies of a retracted sequence keep its edges
+    retracted = list(assembler.sequences)[::3]
+    assert assembler.retract_segments(retracted + [-1]) == len(retracted)
+    G = construct_graph(list(dict.fromkeys(assembler.sequences.values())), 3)
+    assert sorted(assembler.graph.edges()) == sorted(G.edges())
+    assert sorted(assembler.graph.nodes()) == sorted(G.nodes())
+    assert assembler.check().valid == _check_graph(G).valid
+    assert assembler.check().imbalance == _check_graph(G).imbalance
+
+
+@mark.parametrize('batches, k, expected', [
+    ([{1: "ATTAGAC"}, {2: "ACCTGCCG"}, {3: "CGGAAGG"}], 3, "ATTAGACCTGCCGGAAGG"),
+    ([{1: "TTAATT"}, {2: "ATTACT"}, {3: "TTAATT"}], 4, "TTAATTACT"),
+])
+def test_incremental_assembler_assemble(batches: list, k: int, expected: str) -> None:
+    assembler = IncrementalAssembler(k)
+    for batch in batches:
+        assembler.add_sequences(batch)
+    assert assembler.assemble() == expected
+    assert assembler.check().start == expected[:k - 1]
+
+    # a retracted segment takes its edges with it, and adding it back restores them
+    assembler.retract_segments([2])
+    remaining = {**batches[0], **batches[2]}
+    assert assembler.assemble() == construct_dna_sequence(construct_graph(set(remaining.values()), k))
+    assembler.add_sequences(batches[1])
+    assert assembler.assemble() == expected
+
+
+async def _http(port: int, method: str, path: str, payload=None) -> tuple:
+    """ Helper function that sends one HTTP request to a JobService on
+    localhost and returns the status and the decoded body of the response"""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    content = b"" if payload is None else json.dumps(payload).encode("ascii")
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(content)}\r\n\r\n".encode("ascii")
+                 + content)
+    response = await reader.read()
+    writer.close()
+    head, _, body = response.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(body) if b"application/json" in head else body.decode("ascii")
+
+
+async def _wait_for(port: int, job_id: str) -> dict:
+    """ Helper function that polls the status of a job until it has finished"""
+    for _ in range(600):
+        _, job = await _http(port, "GET", f"/jobs/{job_id}")
+        if job["status"] in ("done", "failed"):
+            return job
+        await asyncio.sleep(0.05)
+    raise TimeoutError(job_id)
+
+
+def _tiled_segments(length: int, k: int, seed: int = 0) -> tuple:
+    """ Helper function that splits a random genome into segments of 100
+    nucleotides that overlap by k - 1, so that their graph is Eulerian"""
+    step = 100 - k + 1
+    genome = random_genome(length // step * step + k - 1, seed)
+    return genome, {i: genome[start:start + 100] for i, start in enumerate(range(0, len(genome) - 99, step))}
+
+
+def test_job_service(tmp_path) -> None:
+    genome, sequences = _tiled_segments(2000, 15, seed=6)
+    rows = [[nr, i + 1, *(int(base == c) for c in "ACGT")] for nr, seq in sequences.items()
+            for i, base in enumerate(seq)]
+    name = tmp_path / "DNA_1_15.csv"
+    pd.DataFrame(rows).sample(frac=1, random_state=0).to_csv(name, header=False, index=False)
+
+    async def run() -> None:
+        service = JobService(workers=2)
+        await service.start()
+        port = service.port
+        try:
+            submitted = [await _http(port, "POST", "/jobs", payload) for payload in (
+                {"segments": sequences, "k": 15},
+                {"segments": rows, "k": 15, "packed": False},
+                {"csv": str(name)},
+                {"segments": {"1": "ATTAGACCTG", "2": "CTGCCGGAA", "3": "GAAGG"}, "k": 3},
+            )]
+            assert [status for status, _ in submitted] == [202] * 4
+            jobs = [await _wait_for(port, job["id"]) for _, job in submitted]
+            assert [job["status"] for job in jobs] == ["done"] * 4
+            assert [job["valid"] for job in jobs] == [True, True, True, False]
+            assert jobs[2]["k"] == 15
+
+            for job in jobs[:3]:
+                assert await _http(port, "GET", f"/jobs/{job['id']}/sequence") == (200, genome)
+            status, fasta = await _http(port, "GET", f"/jobs/{jobs[3]['id']}/contigs")
+            contigs = construct_contigs(construct_graph({"1": "ATTAGACCTG", "2": "CTGCCGGAA", "3": "GAAGG"}, 3))
+            assert status == 200 and fasta.count(">") == len(contigs) == jobs[3]["contigs"]
+
+            assert (await _http(port, "GET", "/jobs"))[1] == jobs
+            assert (await _http(port, "GET", "/health"))[1]["queued"] == 0
+            assert (await _http(port, "GET", "/jobs/99"))[0] == 404
+            assert (await _http(port, "DELETE", "/jobs/1"))[0] == 405
+            assert (await _http(port, "POST", "/jobs", {"k": 15}))[0] == 400
+            assert (await _http(port, "POST", "/jobs", {"csv": str(tmp_path / "missing.csv"), "k": 15}))[0] == 400
+            assert (await _http(port, "POST", "/jobs", {"segments": {"1": "ACGT"}, "k": 3, "packed": "false"}))[0] == 400
+            assert (await _http(port, "POST", "/jobs", {"segments": [[1, 1, 1]], "k": 15}))[0] == 202
+        finally:
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_job_service_back_pressure(monkeypatch) -> None:
+    # the jobs run on a thread and wait for release, so the first one is
+    # still running while the next ones arrive
+    release = threading.Event()
+
+    def blocked_job(spec: dict) -> dict:
+        release.wait(10)
+        return {"valid": True, "length": 4, "contigs": 0, "seconds": 0.0, "sequence": "ACGT", "contig_records": []}
+
+    monkeypatch.setattr('project._run_job', blocked_job)
+    monkeypatch.setattr(JobService, '_new_pool', lambda self: ThreadPoolExecutor(self.workers))
+    payload = {"segments": {"1": "ACGT"}, "k": 3}
+
+    async def run() -> None:
+        service = JobService(workers=1, max_queue=1)
+        await service.start()
+        try:
+            assert (await _http(service.port, "POST", "/jobs", payload))[0] == 202
+            while service.jobs["1"]["status"] != "running":
+                await asyncio.sleep(0.01)
+
+            # one job runs and one waits, the others are turned away
+            statuses = [(await _http(service.port, "POST", "/jobs", payload))[0] for _ in range(3)]
+            assert statuses == [202, 503, 503]
+            status, error = await _http(service.port, "GET", "/jobs/2/sequence")
+            assert status == 409 and "queued" in error["error"]
+
+            release.set()
+            for job_id in ("1", "2"):
+                assert (await _wait_for(service.port, job_id))["status"] == "done"
+            assert await _http(service.port, "GET", "/jobs/2/sequence") == (200, "ACGT")
+            assert (await _http(service.port, "POST", "/jobs", payload))[0] == 202
+        finally:
+            release.set()
+            await service.close()
+
+    asyncio.run(run())
+
+
+def test_job_service_broken_pool(monkeypatch) -> None:
+    release = threading.Event()
+    pools = []
+
+    def broken_job(spec: dict) -> dict:
+        release.wait(10)
+        raise BrokenProcessPool("a worker died")
+
+    def new_pool(self) -> ThreadPoolExecutor:
+        pools.append(ThreadPoolExecutor(self.workers))
+        return pools[-1]
+
+    monkeypatch.setattr('project._run_job', broken_job)
+    monkeypatch.setattr(JobService, '_new_pool', new_pool)
+
+    async def run() -> None:
+        service = JobService(workers=2)
+        await service.start()
+        try:
+            for _ in range(2):
+                await _http(service.port, "POST", "/jobs", {"segments": {"1": "ACGT"}, "k": 3})
+            while any(job["status"] != "running" for job in service.jobs.values()):
+                await asyncio.sleep(0.01)
+            release.set()
+            jobs = [await _wait_for(service.port, job_id) for job_id in ("1", "2")]
+            assert [job["status"] for job in jobs] == ["failed", "failed"]
+            # both jobs were on the same broken pool, which is replaced once
+            assert len(pools) == 2 and service._pool is pools[1]
+            assert pools[0]._shutdown
+        finally:
+            await service.close()
+
+    asyncio.run(run())